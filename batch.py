@@ -0,0 +1,116 @@
+import csv
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from capture import BINARY_EXTENSION
+from hrv_core import HRV
+from replay import read_capture, replay
+
+# Reprocesses archives of captures across a process pool and streams one
+# result row per capture to CSV or JSON lines.
+
+FIELDS = ("file", "samples", "beats", "rejected", "mean_ppi", "mean_hr", "sdnn", "rmssd", "error")
+
+def find_captures(paths, pattern=(".txt", BINARY_EXTENSION)):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(pattern):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def process_stream(path):
+    hrv = HRV()
+    hrv.verbose = False
+    hrv, count = replay(read_capture([path]), hrv)
+    row = {"file": path, "samples": count, "beats": hrv.stats.count, "rejected": hrv.stats.rejected}
+    if hrv.stats.count >= 2:
+        row.update({"mean_ppi": hrv.stats.mean_ppi(), "mean_hr": hrv.stats.mean_hr(),
+                    "sdnn": hrv.stats.sdnn(), "rmssd": hrv.stats.rmssd()})
+    return row
+
+def process_numpy(path):
+    import hrv_batch
+    results = hrv_batch.analyze(hrv_batch.load_samples(path))
+    row = {"file": path, "samples": results["samples"], "beats": results["count"], "rejected": results["rejected"]}
+    for key in ("mean_ppi", "mean_hr", "sdnn", "rmssd"):
+        if key in results:
+            row[key] = float(results[key])
+    return row
+
+ENGINES = {"stream": process_stream, "numpy": process_numpy}
+
+def process(job):
+    # a broken capture is reported in its row instead of stopping the run
+    engine, path = job
+    try:
+        return ENGINES[engine](path)
+    except Exception as e:
+        return {"file": path, "error": f"{type(e).__name__}: {e}"}
+
+class CsvWriter:
+    def __init__(self, f):
+        self.f = f
+        self.writer = csv.DictWriter(f, FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow({key: round(value, 3) if isinstance(value, float) else value for key, value in row.items()})
+        self.f.flush()
+
+class JsonLinesWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, row):
+        self.f.write(json.dumps(row) + "\n")
+        self.f.flush()
+
+def run(paths, engine="stream", workers=None, writer=None, chunksize=4):
+    jobs = [(engine, path) for path in find_captures(paths)]
+    stats = {"files": 0, "samples": 0, "errors": 0, "workers": workers or os.cpu_count()}
+    start = time.perf_counter()
+    with Pool(workers) as pool:
+        for row in pool.imap_unordered(process, jobs, chunksize):
+            stats["files"] += 1
+            stats["samples"] += row.get("samples", 0)
+            stats["errors"] += "error" in row
+            if writer:
+                writer.write(row)
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Analyze directories of captures in parallel")
+    parser.add_argument("paths", nargs="+", help="capture files or directories searched for *.txt and *.ppg")
+    parser.add_argument("-o", "--output", help="output file, stdout by default")
+    parser.add_argument("-f", "--format", choices=("csv", "jsonl"), help="output format, from the output file extension by default")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes, all cores by default")
+    parser.add_argument("-e", "--engine", choices=sorted(ENGINES), default="stream", help="per-sample HRV path or the NumPy batch path")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("jsonl" if args.output and args.output.endswith((".jsonl", ".json")) else "csv")
+    f = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        writer = JsonLinesWriter(f) if fmt == "jsonl" else CsvWriter(f)
+        stats = run(args.paths, args.engine, args.workers, writer)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+    elapsed = stats["elapsed"]
+    print(f"{stats['files']} captures ({stats['errors']} failed), {stats['samples']} samples "
+          f"in {elapsed:.2f} s on {stats['workers']} workers: "
+          f"{stats['files'] / elapsed:.1f} captures/s, {stats['samples'] / elapsed:.0f} samples/s",
+          file=sys.stderr)
+    return 1 if stats["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
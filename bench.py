@@ -0,0 +1,371 @@
+import json
+import sys
+import time
+from array import array
+
+from hrv_core import HRV
+from graph import Graph
+from replay import prime
+import filters
+
+# Per-sample cost of the measurement hot path. Runs on CPython with a stub
+# framebuffer and on the Pico (copy a capture file to flash and call
+# bench.run("capture_250Hz_01.txt") from the REPL) with a RAM framebuffer.
+#
+# Stages are timed cumulatively: every pass adds one stage of the
+# measurement screens and the cost of a stage is the difference to the
+# previous pass. Drawing happens once per frame and is reported per sample.
+# The detector alone (threshold and peaks) is also timed on the integer
+# kernel of detector.py and on the HRV methods it replaced, in samples per
+# second, and both must find the same intervals. With --filter the cost of
+# the filter chain is added to the total, and the
+# usable intervals with and without it are compared on the captures and on
+# copies corrupted with motion artefacts.
+
+STAGES = ("threshold", "peaks", "graph", "draw")
+FIFO_SIZE = 100 # Sensor.fifo capacity
+FRAME_SAMPLES = 10 # samples per frame at 250 Hz and 25 FPS
+MICROPYTHON = sys.implementation.name == "micropython"
+
+if MICROPYTHON:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+else:
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+    def ticks_diff(a, b):
+        return a - b
+
+class StubFrameBuffer:
+    # Just enough of framebuf.FrameBuffer (MONO_VLSB) for the drawing calls
+    # of the measurement screens. Text is drawn as solid 8x8 cells.
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.buffer = bytearray(width * height // 8)
+
+    def pixel(self, x, y, c):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            i = (y >> 3) * self.width + x
+            if c:
+                self.buffer[i] |= 1 << (y & 7)
+            else:
+                self.buffer[i] &= ~(1 << (y & 7))
+
+    def fill(self, c):
+        v = 0xff if c else 0
+        for i in range(len(self.buffer)):
+            self.buffer[i] = v
+
+    def fill_rect(self, x, y, w, h, c):
+        self.rect(x, y, w, h, c, True)
+
+    def scroll(self, dx, dy):
+        # horizontal only, which is all the graph uses
+        for page in range(self.height // 8):
+            row = page * self.width
+            for x in (range(self.width + dx) if dx < 0 else range(self.width - 1, dx - 1, -1)):
+                self.buffer[row + x] = self.buffer[row + x - dx]
+
+    def blit(self, fb, x, y):
+        if y & 7 == 0 and 0 <= x and x + fb.width <= self.width:
+            # page aligned, copy whole bytes like the real one does
+            for page in range(min(fb.height, self.height - y) >> 3):
+                row = (page + (y >> 3)) * self.width + x
+                self.buffer[row:row + fb.width] = fb.buffer[page * fb.width:(page + 1) * fb.width]
+            return
+        for yy in range(fb.height):
+            for xx in range(fb.width):
+                self.pixel(x + xx, y + yy, fb.buffer[(yy >> 3) * fb.width + xx] >> (yy & 7) & 1)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            for yy in range(y, y + h):
+                for xx in range(x, x + w):
+                    self.pixel(xx, yy, c)
+        else:
+            self.line(x, y, x + w - 1, y, c)
+            self.line(x, y + h - 1, x + w - 1, y + h - 1, c)
+            self.line(x, y, x, y + h - 1, c)
+            self.line(x + w - 1, y, x + w - 1, y + h - 1, c)
+
+    def line(self, x0, y0, x1, y1, c):
+        dx = abs(x1 - x0)
+        dy = -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x0, y0, c)
+            if x0 == x1 and y0 == y1:
+                return
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def text(self, s, x, y, c=1):
+        for i in range(len(s)):
+            self.rect(x + i * 8, y, 8, 8, c, True)
+
+def framebuffer(width=128, height=64):
+    if MICROPYTHON:
+        import framebuf
+        return framebuf.FrameBuffer(bytearray(width * height // 8), width, height, framebuf.MONO_VLSB)
+    return StubFrameBuffer(width, height)
+
+def load_samples(path):
+    samples = array("H")
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                samples.append(int(line))
+    return samples
+
+def run_pass(samples, level, oled, graph):
+    # one pass of UI.process_samples + measurement_render with the first
+    # `level` stages enabled
+    hrv = HRV()
+    hrv.verbose = False
+    it = iter(samples)
+    prime(hrv, it)
+    graph.reset()
+    count = 0
+    frame = 0
+    start = ticks_us()
+    for point in it:
+        count += 1
+        hrv.calculate_threshold(point)
+        if level > 1:
+            hrv.analyze_peaks(point)
+        if level > 2:
+            graph.add(point, hrv.min_point, hrv.max_point)
+        if level > 3:
+            frame += 1
+            if frame >= FRAME_SAMPLES:
+                frame = 0
+                graph.draw(oled)
+                oled.rect(102,0, 28, 20, 0, 1)
+                oled.text(f"{int(hrv.bpm_output)}",102,0,1)
+                oled.text("Collecting data",5,50,1)
+    return ticks_diff(ticks_us(), start), count
+
+def detector_pass(samples, kernel):
+    # the threshold and peak detection of UI.process_samples on the kernel
+    # or on the bytecode methods
+    hrv = HRV(True, kernel=kernel)
+    hrv.verbose = False
+    it = iter(samples)
+    prime(hrv, it)
+    calculate_threshold = hrv.calculate_threshold
+    analyze_peaks = hrv.analyze_peaks
+    count = 0
+    start = ticks_us()
+    for point in it:
+        count += 1
+        calculate_threshold(point)
+        analyze_peaks(point)
+    return ticks_diff(ticks_us(), start), count, list(hrv.total_intervals)
+
+def filter_cost(samples, spec, rounds=5):
+    # us per sample of the filter chain alone, the loop itself subtracted
+    best = None
+    for _ in range(rounds):
+        sample_filter = filters.make(spec)
+        start = ticks_us()
+        for point in samples:
+            pass
+        empty = ticks_diff(ticks_us(), start)
+        start = ticks_us()
+        for point in samples:
+            sample_filter.filter(point)
+        elapsed = ticks_diff(ticks_us(), start) - empty
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / len(samples)
+
+def add_noise(samples, seed, wander=3000, noise=400, spikes=0.002):
+    # Motion artefacts on a clean capture: baseline wander at breathing and
+    # slower rates, white noise and the odd spike
+    import math
+    import random
+    rng = random.Random(seed)
+    for i, point in enumerate(samples):
+        t = i / 250
+        y = point + wander * math.sin(2 * math.pi * 0.25 * t) + wander / 2 * math.sin(2 * math.pi * 0.07 * t + 1)
+        y += rng.gauss(0, noise)
+        if rng.random() < spikes:
+            y += rng.choice((-1, 1)) * rng.uniform(2000, 8000)
+        yield max(0, min(65535, int(y)))
+
+def filter_effect(paths, spec, seeds=5, repeat=3):
+    # Beats detected, usable intervals and the mean RMSSD error against the
+    # clean unfiltered replay, for the clean and the corrupted captures
+    # without and with the filter (host only)
+    from replay import read_capture, replay
+    rows = []
+    for noisy in (False, True):
+        for run_spec in ("", spec):
+            detected = usable = 0
+            errors = []
+            for path in paths:
+                clean = HRV()
+                clean.verbose = False
+                replay(read_capture([path], repeat), clean)
+                for seed in range(seeds if noisy else 1):
+                    samples = read_capture([path], repeat)
+                    if noisy:
+                        samples = add_noise(samples, seed)
+                    hrv = HRV()
+                    hrv.verbose = False
+                    replay(filters.apply(filters.make(run_spec), samples), hrv)
+                    detected += hrv.stats.count + hrv.stats.rejected
+                    usable += hrv.stats.count
+                    if hrv.stats.count >= 2 and clean.stats.count >= 2:
+                        errors.append(abs(hrv.stats.rmssd() - clean.stats.rmssd()))
+            rows.append(("noisy" if noisy else "clean", run_spec or "none", detected, usable,
+                         sum(errors) / len(errors) if errors else 0))
+    return rows
+
+def measure_show():
+    # Time of one full oled.show() over I2C, only measurable on the device
+    from machine import Pin, I2C
+    from ssd1306 import SSD1306_I2C
+    oled = SSD1306_I2C(128, 64, I2C(1, scl=Pin(15), sda=Pin(14), freq=400000))
+    start = ticks_us()
+    for _ in range(10):
+        oled.show()
+    return ticks_diff(ticks_us(), start) / 10
+
+def estimate_show():
+    # 1 KB framebuffer plus addressing at 9 bits per byte on 400 kHz I2C
+    return (1024 + 16) * 9 / 400000 * 1e6
+
+def run(paths, rounds=5, show_us=None, spec=""):
+    if isinstance(paths, str):
+        paths = [paths]
+    oled = framebuffer()
+    graph = Graph(framebuffer=None if MICROPYTHON else StubFrameBuffer(101, 64))
+    totals = [0] * len(STAGES)
+    samples_total = 0
+    filter_total = filter_samples = 0
+    detector_us = [0, 0] # bytecode, kernel
+    detector_samples = 0
+    detector_match = True
+    for path in paths:
+        samples = load_samples(path)
+        intervals = []
+        for kernel in (0, 1):
+            best = None
+            for _ in range(rounds):
+                elapsed, count, found = detector_pass(samples, kernel)
+                if best is None or elapsed < best:
+                    best = elapsed
+            detector_us[kernel] += best
+            intervals.append(found)
+        detector_samples += count
+        detector_match = detector_match and intervals[0] == intervals[1]
+        if spec:
+            filter_total += filter_cost(samples, spec, rounds) * len(samples)
+            filter_samples += len(samples)
+        for level in range(1, len(STAGES) + 1):
+            best = None
+            for _ in range(rounds):
+                elapsed, count = run_pass(samples, level, oled, graph)
+                if best is None or elapsed < best:
+                    best = elapsed
+            totals[level - 1] += best
+        samples_total += count
+    if show_us is None:
+        try:
+            show_us = measure_show() if MICROPYTHON else estimate_show()
+        except Exception:
+            show_us = estimate_show()
+
+    results = {}
+    previous = 0
+    for name, total in zip(STAGES, totals):
+        results[name] = (total - previous) / samples_total
+        previous = total
+    per_sample = totals[-1] / samples_total
+    if spec:
+        results["filter"] = filter_total / filter_samples
+        per_sample += results["filter"]
+    results["total"] = per_sample
+    results["show"] = show_us
+    results["detector_bytecode"] = detector_samples * 1e6 / detector_us[0] if detector_us[0] else 0
+    results["detector_kernel"] = detector_samples * 1e6 / detector_us[1] if detector_us[1] else 0
+    results["detector_match"] = detector_match
+    # Processing alone limits the rate to one sample per per_sample us. While
+    # oled.show() blocks, samples pile up in the FIFO; with a drain of n
+    # samples per display() n = rate*(show + n*per_sample), so the FIFO (which
+    # holds size-1 values) overflows once rate > (size-1)/(show + (size-1)*per_sample).
+    results["max_rate_cpu"] = 1e6 / per_sample if per_sample else 0
+    results["max_rate_fifo"] = (FIFO_SIZE - 1) * 1e6 / (show_us + (FIFO_SIZE - 1) * per_sample)
+    depth = 250 * show_us / 1e6
+    load = 250 * per_sample / 1e6
+    results["fifo_depth_250hz"] = depth / (1 - load) if load < 1 else float("inf")
+    return results
+
+def report(results, baseline=None, tolerance=0.2):
+    # Prints the results and returns the stages that regressed past tolerance
+    regressions = []
+    for name in STAGES + (("filter",) if "filter" in results else ()) + ("total",):
+        line = f"{name:<10} {results[name]:9.2f} us/sample"
+        if baseline and name in baseline and baseline[name] > 0:
+            change = results[name] / baseline[name] - 1
+            line += f"  {change * 100:+6.1f}% vs baseline"
+            if change > tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    print(f"oled.show  {results['show']:9.0f} us/frame")
+    print(f"max rate, processing only:   {results['max_rate_cpu']:9.0f} Hz")
+    print(f"max rate before FIFO overflow: {results['max_rate_fifo']:7.0f} Hz")
+    print(f"FIFO depth at 250 Hz:        {results['fifo_depth_250hz']:9.1f} of {FIFO_SIZE - 1}")
+    if "detector_kernel" in results:
+        speedup = results["detector_kernel"] / results["detector_bytecode"] if results["detector_bytecode"] else 0
+        print(f"detector, bytecode methods:  {results['detector_bytecode']:9.0f} samples/s")
+        print(f"detector, kernel:            {results['detector_kernel']:9.0f} samples/s  x{speedup:.2f}"
+              + ("" if results["detector_match"] else "  INTERVALS DIFFER"))
+    return regressions
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the per-sample measurement path")
+    parser.add_argument("captures", nargs="+", help="capture files")
+    parser.add_argument("--rounds", type=int, default=5, help="passes per stage, the fastest one counts")
+    parser.add_argument("--show-us", type=float, help="oled.show() time instead of the I2C estimate")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="stored baseline to compare against")
+    parser.add_argument("--save", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown per stage (0.2 = 20%%)")
+    parser.add_argument("--filter", default="", help="also time this filter chain (see filters.py) and compare the usable intervals with and without it")
+    args = parser.parse_args(argv)
+
+    results = run(args.captures, args.rounds, args.show_us, args.filter)
+    baseline = None
+    if not args.save:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except OSError:
+            print(f"no baseline at {args.baseline}, run with --save to store one")
+    regressions = report(results, baseline, args.tolerance)
+    if not results["detector_match"]:
+        regressions.append("detector")
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline stored in {args.baseline}")
+    if args.filter:
+        print(f"{'signal':<7} {'filter':<12} {'beats':>6} {'usable':>6} {'RMSSD error':>12}")
+        for signal, spec, detected, usable, error in filter_effect(args.captures, args.filter):
+            print(f"{signal:<7} {spec:<12} {detected:>6} {usable:>6} {error:>9.1f} ms")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
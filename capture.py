@@ -0,0 +1,125 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# Constant-memory access to capture files. Text captures (one ADC value per
+# line, as in sample_data/) and the compact binary format are memory-mapped
+# and handed out in chunks of samples as array('H').
+#
+# Binary format: an 8 byte header (magic b"PPG1", uint16 sample rate in Hz,
+# uint16 reserved) followed by the samples as little-endian uint16.
+
+MAGIC = b"PPG1"
+HEADER = struct.Struct("<4sHH")
+BINARY_EXTENSION = ".ppg"
+CHUNK = 1 << 16 # samples per chunk
+
+def _map(f):
+    # mmap refuses empty files
+    if os.fstat(f.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def is_binary(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def sample_rate(path, default=250):
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) == HEADER.size and header[:len(MAGIC)] == MAGIC:
+        return HEADER.unpack(header)[1]
+    return default
+
+def _binary_chunks(data, chunk):
+    end = HEADER.size + (len(data) - HEADER.size) // 2 * 2 ## a truncated last sample is ignored
+    step = chunk * 2
+    for offset in range(HEADER.size, end, step):
+        samples = array("H")
+        samples.frombytes(data[offset:min(offset + step, end)])
+        if sys.byteorder == "big":
+            samples.byteswap()
+        yield samples
+
+def _text_chunks(data, chunk):
+    # Roughly `chunk` samples per block; a block always ends on a line break
+    # so no value is split between two chunks
+    block = chunk * 6
+    start = 0
+    size = len(data)
+    while start < size:
+        end = min(start + block, size)
+        if end < size:
+            newline = data.rfind(b"\n", start, end)
+            if newline < 0:
+                newline = data.find(b"\n", end)
+                end = size if newline < 0 else newline + 1
+            else:
+                end = newline + 1
+        yield array("H", map(int, data[start:end].split()))
+        start = end
+
+def iter_chunks(path, chunk=CHUNK):
+    with open(path, "rb") as f:
+        data = _map(f)
+        if data is None:
+            return
+        try:
+            if data[:len(MAGIC)] == MAGIC:
+                yield from _binary_chunks(data, chunk)
+            else:
+                yield from _text_chunks(data, chunk)
+        finally:
+            data.close()
+
+def iter_samples(path, chunk=CHUNK):
+    for samples in iter_chunks(path, chunk):
+        yield from samples
+
+def convert(src, dst, rate=250):
+    # text -> binary, or binary -> text when src is already binary
+    binary = is_binary(src)
+    count = 0
+    with open(dst, "wb") as out:
+        if not binary:
+            out.write(HEADER.pack(MAGIC, rate, 0))
+        for samples in iter_chunks(src):
+            if binary:
+                out.write(b"".join(b"%d\n" % sample for sample in samples))
+            else:
+                if sys.byteorder == "big":
+                    samples.byteswap()
+                samples.tofile(out)
+            count += len(samples)
+    return count
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Inspect and convert PPG captures")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="print the format, sample count and duration of captures")
+    info.add_argument("captures", nargs="+")
+    conv = commands.add_parser("convert", help="convert a text capture to binary or a binary capture back to text")
+    conv.add_argument("src")
+    conv.add_argument("dst", nargs="?", help=f"defaults to src with {BINARY_EXTENSION} or .txt")
+    conv.add_argument("--rate", type=int, default=250, help="sample rate stored in the binary header")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        for path in args.captures:
+            count = sum(len(samples) for samples in iter_chunks(path))
+            rate = sample_rate(path)
+            kind = "binary" if is_binary(path) else "text"
+            print(f"{path}: {kind}, {count} samples, {count / rate:.1f} s at {rate} Hz")
+    else:
+        dst = args.dst
+        if dst is None:
+            dst = os.path.splitext(args.src)[0] + (".txt" if is_binary(args.src) else BINARY_EXTENSION)
+        count = convert(args.src, dst, args.rate)
+        print(f"{args.src} -> {dst}: {count} samples, {os.path.getsize(args.src)} -> {os.path.getsize(dst)} bytes")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
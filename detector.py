@@ -0,0 +1,152 @@
+import sys
+from array import array
+
+# Integer kernel of the beat detector for the per-sample hot path. The state
+# that HRV and SlidingMinMax keep in attributes lives in two int arrays here:
+# `state` holds the counters and the current values, `queues` the monotonic
+# min and max deques of the threshold window. track() and detect() only use
+# local variables and array accesses, so on the Pico they compile with the
+# viper emitter to machine code (only the literal @micropython.viper selects
+# it). On a computer (and in the simulation) they run as plain Python and
+# give the same results.
+#
+# Thresholds are kept doubled (low + high instead of (low + high) / 2), which
+# keeps everything in integers without changing any comparison.
+
+if sys.implementation.name == "micropython":
+    import micropython
+    from micropython import const
+else:
+    class micropython:
+        @staticmethod
+        def viper(f):
+            return f
+
+    def const(value):
+        return value
+
+    def ptr32(buffer): ## viper's pointer cast, an array already indexes the same way
+        return buffer
+
+WINDOW = const(0) # samples the min-max window spans
+COUNT = const(1) # samples added to the window
+MAX_HEAD = const(2)
+MAX_LEN = const(3)
+MIN_HEAD = const(4)
+MIN_LEN = const(5)
+LOW = const(6) # min_point
+HIGH = const(7) # max_point
+READY = const(8) # 1 once the window has filled and there is a threshold
+PEAK = const(9) # current_peak * 2
+PEAK_I = const(10) # samples through detect()
+PEAK_INDEX = const(11) # current_peak_index
+PREVIOUS = const(12) # peak_previous_index, -1 for none yet
+STATE_SIZE = 13
+
+def new_state(window):
+    state = array('i', [0] * STATE_SIZE)
+    state[WINDOW] = window
+    return state
+
+def new_queues(window):
+    # max indices, max values, min indices and min values back to back
+    return array('i', [0] * (4 * window))
+
+def start(state, queues, point):
+    # first sample of a measurement, like HRV.start()
+    for i in range(1, STATE_SIZE):
+        state[i] = 0
+    state[LOW] = state[HIGH] = point
+    state[PREVIOUS] = -1
+    track(state, queues, point)
+
+@micropython.viper
+def track(state, queues, point) -> int:
+    # SlidingMinMax.add() and the threshold of HRV.calculate_threshold().
+    # Returns 1 when min_point, max_point and so the threshold changed.
+    s = ptr32(state)
+    q = ptr32(queues)
+    p = int(point)
+    w = s[WINDOW]
+    i = s[COUNT]
+    # maxima: indices at q[0:w], values at q[w:2w]
+    head = s[MAX_HEAD]
+    n = s[MAX_LEN]
+    while n > 0:
+        back = head + n - 1
+        if back >= w:
+            back -= w
+        if q[w + back] > p:
+            break
+        n -= 1
+    if n > 0 and q[head] <= i - w:
+        head += 1
+        if head == w:
+            head = 0
+        n -= 1
+    back = head + n
+    if back >= w:
+        back -= w
+    q[back] = i
+    q[w + back] = p
+    s[MAX_HEAD] = head
+    s[MAX_LEN] = n + 1
+    high = q[w + head]
+    # minima: indices at q[2w:3w], values at q[3w:4w]
+    head = s[MIN_HEAD]
+    n = s[MIN_LEN]
+    while n > 0:
+        back = head + n - 1
+        if back >= w:
+            back -= w
+        if q[3 * w + back] < p:
+            break
+        n -= 1
+    if n > 0 and q[2 * w + head] <= i - w:
+        head += 1
+        if head == w:
+            head = 0
+        n -= 1
+    back = head + n
+    if back >= w:
+        back -= w
+    q[2 * w + back] = i
+    q[3 * w + back] = p
+    s[MIN_HEAD] = head
+    s[MIN_LEN] = n + 1
+    low = q[3 * w + head]
+    i += 1
+    s[COUNT] = i
+    if i < w:
+        return 0
+    if s[READY] == 0:
+        s[READY] = 1
+        s[PEAK] = low + high
+    elif low == s[LOW] and high == s[HIGH]:
+        return 0
+    s[LOW] = low
+    s[HIGH] = high
+    return 1
+
+@micropython.viper
+def detect(state, point) -> int:
+    # HRV.detect_peak(): the interval in samples between the last two peaks
+    # when a peak ends on this sample, otherwise 0
+    s = ptr32(state)
+    p = int(point)
+    i = s[PEAK_I] + 1
+    s[PEAK_I] = i
+    level = s[LOW] + s[HIGH]
+    if p + p > level:
+        if p + p >= s[PEAK]:
+            s[PEAK] = p + p
+            s[PEAK_INDEX] = i
+        return 0
+    interval = 0
+    peak_index = s[PEAK_INDEX]
+    previous = s[PREVIOUS]
+    if previous >= 0 and peak_index != previous:
+        interval = peak_index - previous
+    s[PEAK] = level
+    s[PREVIOUS] = peak_index
+    return interval
@@ -0,0 +1,87 @@
+from ssd1306 import SSD1306_I2C
+import sys
+if sys.implementation.name == "micropython":
+    import micropython
+else:
+    # CPython, the simulation included: the code emitter is a no-op
+    class micropython:
+        @staticmethod
+        def viper(f):
+            return f
+    ptr8 = bytearray # the viper pointer type is just the buffer
+
+# SSD1306 that only sends what changed. show() compares the framebuffer to a
+# copy of what the display already shows and transmits, per 8-pixel page,
+# only the columns between the first and the last changed byte. Unchanged
+# frames are not sent at all, so screens can keep redrawing everything with
+# fill(0) + text() without paying for a full 1 KB transfer every frame.
+
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+@micropython.viper
+def diff_columns(buf: ptr8, shadow: ptr8, start: int, width: int) -> int:
+    # First and last differing column of a page as first << 8 | last, -1 if
+    # the page is unchanged. The shadow copy is updated on the way.
+    first = -1
+    last = -1
+    for x in range(width):
+        i = start + x
+        if buf[i] != shadow[i]:
+            if first < 0:
+                first = x
+            last = x
+            shadow[i] = buf[i]
+    if first < 0:
+        return -1
+    return (first << 8) | last
+
+class DirtySSD1306_I2C(SSD1306_I2C):
+    def __init__(self, width, height, i2c, addr=0x3C, external_vcc=False):
+        # set up before the driver, its init already calls show()
+        self.shadow = None
+        self.valid = False # shadow matches the display
+        # counters for profiling
+        self.frames = 0
+        self.skipped = 0
+        self.bytes_sent = 0
+        super().__init__(width, height, i2c, addr, external_vcc)
+        self.shadow = bytearray(len(self.buffer))
+        self.view = memoryview(self.buffer)
+        self.valid = False
+
+    def invalidate(self):
+        # next show() sends the whole frame
+        self.valid = False
+
+    def show(self):
+        self.frames += 1
+        if not self.valid:
+            super().show()
+            if self.shadow is None:
+                return
+            self.shadow[:] = self.buffer
+            self.valid = True
+            self.bytes_sent += len(self.buffer)
+            return
+        width = self.width
+        sent = 0
+        for page in range(self.pages):
+            start = page * width
+            span = diff_columns(self.buffer, self.shadow, start, width)
+            if span < 0:
+                continue
+            first = span >> 8
+            last = span & 0xff
+            self.write_cmd(SET_COL_ADDR)
+            self.write_cmd(first)
+            self.write_cmd(last)
+            self.write_cmd(SET_PAGE_ADDR)
+            self.write_cmd(page)
+            self.write_cmd(page)
+            self.write_data(self.view[start + first:start + last + 1])
+            sent += last - first + 1
+        if sent:
+            self.bytes_sent += sent
+        else:
+            self.skipped += 1
@@ -0,0 +1,110 @@
+from array import array
+
+# Integer filters for the PPG samples between the sensor FIFO and the
+# detector. A filter has filter(x) -> y and reset(); Chain runs several in
+# order. Per sample they only add, shift and store into preallocated
+# arrays, so the cost is constant, nothing is allocated and no floats are
+# involved. make() builds a chain from a spec such as "dc:6,ma:8":
+#
+#   dc:<shift>   DC blocker, removes the baseline (time constant 2**shift
+#                samples, 6 is about 0.6 Hz at 250 Hz)
+#   ma:<length>  moving average low-pass of length samples
+#   lp:<shift>   one-pole IIR low-pass (time constant 2**shift samples)
+
+class DcBlocker:
+    # Subtracts an exponential moving average of the input, a first order
+    # high-pass with its corner at about rate / (2 pi 2**shift). The output
+    # is centred on offset so that it stays positive like the ADC values.
+    def __init__(self, shift=6, offset=32768):
+        self.shift = shift
+        self.offset = offset
+        self.reset()
+
+    def reset(self):
+        self.acc = None # average << shift
+
+    def filter(self, x):
+        if self.acc is None:
+            self.acc = x << self.shift
+        self.acc += x - (self.acc >> self.shift)
+        return x - (self.acc >> self.shift) + self.offset
+
+class MovingAverage:
+    # Mean of the latest length samples from a ring buffer and a running
+    # sum. The first sample fills the buffer so there is no ramp at start.
+    def __init__(self, length=8):
+        self.data = array('i', [0] * length)
+        self.length = length
+        self.reset()
+
+    def reset(self):
+        self.i = 0
+        self.total = None
+
+    def filter(self, x):
+        data = self.data
+        if self.total is None:
+            for i in range(self.length):
+                data[i] = x
+            self.total = x * self.length
+        i = self.i
+        self.total += x - data[i]
+        data[i] = x
+        i += 1
+        self.i = 0 if i == self.length else i
+        return self.total // self.length
+
+class LowPass:
+    # One-pole IIR y += (x - y) / 2**shift, kept with shift extra bits so
+    # small steps are not lost
+    def __init__(self, shift=2):
+        self.shift = shift
+        self.reset()
+
+    def reset(self):
+        self.acc = None # y << shift
+
+    def filter(self, x):
+        if self.acc is None:
+            self.acc = x << self.shift
+        self.acc += x - (self.acc >> self.shift)
+        return self.acc >> self.shift
+
+class Chain:
+    def __init__(self, filters):
+        self.filters = filters
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+
+    def filter(self, x):
+        for f in self.filters:
+            x = f.filter(x)
+        return x
+
+KINDS = {"dc": DcBlocker, "ma": MovingAverage, "lp": LowPass}
+
+def make(spec):
+    # Chain for a spec like "dc:6,ma:8", None for an empty spec
+    filters = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        fields = part.split(":")
+        name = fields[0]
+        if name not in KINDS:
+            raise ValueError(f"unknown filter: {name}")
+        filters.append(KINDS[name](int(fields[1])) if len(fields) > 1 else KINDS[name]())
+    if not filters:
+        return None
+    return filters[0] if len(filters) == 1 else Chain(filters)
+
+def apply(sample_filter, samples):
+    # samples through sample_filter, unchanged when it is None
+    if sample_filter is None:
+        yield from samples
+        return
+    for x in samples:
+        yield sample_filter.filter(x)
@@ -0,0 +1,75 @@
+from array import array
+
+# Scrolling PPG graph used by the measurement screens. Samples are averaged
+# into columns with an integer accumulator and scaled with a fixed-point
+# factor, so the per-sample work has no floats. The graph keeps its own
+# framebuffer: a frame scrolls it left by the number of new columns, draws
+# only those and blits the result to the screen.
+
+SCALE_BITS = 16 # fixed-point fraction bits of the scale factor (Q16, so
+# that 16-bit signal ranges still get a non-zero factor; acc stays a small int)
+
+class Graph:
+    def __init__(self, width=101, height=64, decimation=7, span=378, offset=20, framebuffer=None):
+        self.width = width
+        self.height = height
+        self.decimation = decimation # samples per column
+        # The signal range maps onto span/10 pixels starting offset pixels
+        # above the bottom (60% of the screen)
+        self.span = span
+        self.bottom = height - 1 - offset
+        if framebuffer is None:
+            import framebuf
+            framebuffer = framebuf.FrameBuffer(bytearray(width * ((height + 7) // 8)), width, height, framebuf.MONO_VLSB)
+        self.fb = framebuffer
+        self.pending = array('b') # columns waiting for the next frame
+        for i in range(32):
+            self.pending.append(0)
+        self.reset()
+
+    def reset(self):
+        self.fb.fill(0)
+        self.count = 0 ## pending columns
+        self.acc = 0
+        self.n = 0
+        self.low = 0
+        self.high = 0
+        self.scale = 0
+        self.last = self.bottom
+
+    def add(self, point, low, high):
+        # low/high: current min and max of the signal
+        if low != self.low or high != self.high:
+            self.low = low
+            self.high = high
+            self.scale = (self.span << SCALE_BITS) // (10 * (high - low)) if high > low else 0
+        self.acc += (point - low) * self.scale
+        self.n += 1
+        if self.n >= self.decimation:
+            y = self.bottom - ((self.acc // self.n) >> SCALE_BITS)
+            if y < 0:
+                y = 0
+            elif y >= self.height:
+                y = self.height - 1
+            if self.count < len(self.pending):
+                self.pending[self.count] = y
+                self.count += 1
+            self.acc = 0
+            self.n = 0
+
+    def draw(self, oled, x=0, y=0):
+        # one scroll and one blit per frame, however many columns arrived
+        n = self.count
+        if n:
+            fb = self.fb
+            width = self.width
+            fb.scroll(-n, 0)
+            fb.fill_rect(width - n, 0, n, self.height, 0)
+            last = self.last
+            for i in range(n):
+                column = self.pending[i]
+                fb.line(width - n + i - 1, last, width - n + i, column, 1)
+                last = column
+            self.last = last
+            self.count = 0
+        oled.blit(self.fb, x, y)
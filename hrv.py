@@ -1,56 +1,82 @@
-from machine import UART, Pin, I2C, Timer, ADC
-from umqtt.simple import MQTTClient
-from ssd1306 import SSD1306_I2C
+from machine import UART, Pin, I2C, Timer, ADC, unique_id
+from dirty_oled import DirtySSD1306_I2C
 from piotimer import Piotimer
 from fifo import Fifo
 from led import Led
+from mqtt_session import MqttSession
+from result_log import ResultLog
+from hrv_core import sample_interval
+from graph import Graph
+import hrv_core
+import filters
 import micropython
+from micropython import const
 import network
 import time
 import json
+import binascii
+import uasyncio as asyncio
 
 micropython.alloc_emergency_exception_buf(200)
 
 i2c = I2C(1, scl=Pin(15), sda=Pin(14), freq=400000)
 oled_width = 128
 oled_height = 64
-oled = SSD1306_I2C(oled_width, oled_height, i2c)
-sample_interval = 4
+oled = DirtySSD1306_I2C(oled_width, oled_height, i2c) # only sends the pages that changed
 
 SSID = "KMD652_Group_5"
 PASSWORD = "T3am-5*4p"
 BROKER_IP = "192.168.5.253"
 BROKER_PORT = 21883
+KUBIOS_TIMEOUT = 20000 # ms to wait for the Kubios reply
+FLUSH_INTERVAL = 10000 # ms between uploads of results queued in the result log
+MQTT_INTERVAL = 100 # ms between checks for incoming MQTT messages
+WLAN_TIMEOUT = 10000 # ms to wait for the association before trying again
+WLAN_CHECK = 5000 # ms between checks that the WLAN is still up
+FRAME_RATE = 25 # screen refreshes per second
+FRAME_INTERVAL = 1000 // FRAME_RATE
+# 1 builds in per-stage timing and the hidden debug screen (rotary button
+# pressed with SW2 held in the menu). With 0 the compiler drops every
+# "if PROFILE:" block, so production firmware pays nothing.
+PROFILE = const(0)
+# 1 publishes the raw samples of every measurement on "hr-ppg/<client id>"
+# (ppg_stream.py, received by ppg_receive.py on a computer)
+PPG_STREAM = const(0)
+# filters.py chain between the sensor FIFO and the detector, e.g. "ma:12"
+# against motion noise; empty feeds the raw samples to the detector
+SAMPLE_FILTER = ""
+CLIENT_ID = "hrv-" + binascii.hexlify(unique_id()).decode() # every board needs its own MQTT client id
 
-def connect_wlan():
-    # Connecting to the group WLAN
-    wlan = network.WLAN(network.STA_IF)
-    wlan.active(True)
-    
-    nets = wlan.scan()               # returns list of tuples
-    print("Nearby SSIDs:")
-    for net in nets:
-        ssid = net[0].decode()
-        print("  ", ssid)
-    
-    wlan.connect(SSID, PASSWORD)
-    print(wlan)
-
-    # Attempt to connect once per second
-    while wlan.isconnected() == False:
-        print("Connecting... ")
-        time.sleep(1)
+wlan = network.WLAN(network.STA_IF)
+mqtt = MqttSession(CLIENT_ID, BROKER_IP, port=BROKER_PORT) # shared connection, opened in the background
+sample_filter = filters.make(SAMPLE_FILTER)
+results_log = ResultLog(device=CLIENT_ID) # every result is queued on flash until it has been uploaded
+if PROFILE:
+    import profiler as prof
+    profiler = prof.Profiler()
+if PPG_STREAM:
+    from ppg_stream import PpgStream
+    ppg_stream = PpgStream()
+    PPG_TOPIC = "hr-ppg/" + CLIENT_ID
 
-    # Print the IP address of the Pico
-    print("Connection successful. Pico IP:", wlan.ifconfig()[0])
+async def connect_wlan():
+    # Joins the group WLAN in the background of the UI and joins again if
+    # the connection drops. No scan first, connect() finds the access point
+    # by itself and a scan blocks for seconds.
+    wlan.active(True)
+    while True:
+        if not wlan.isconnected():
+            print(f"Connecting to {SSID}...")
+            wlan.connect(SSID, PASSWORD)
+            waited = 0
+            while not wlan.isconnected() and waited < WLAN_TIMEOUT:
+                await asyncio.sleep_ms(500)
+                waited += 500
+            if wlan.isconnected():
+                # Print the IP address of the Pico
+                print("Connection successful. Pico IP:", wlan.ifconfig()[0])
+        await asyncio.sleep_ms(WLAN_CHECK)
     
-def transform(y, scale, offset):
-    y *= scale
-    y -= offset
-    y = int(y)
-    y = 63 - y
-    return y
-
 class Encoder:
     def __init__(self, rot_a, rot_b, rot_c):
         self.a = Pin(rot_a, mode = Pin.IN)
@@ -59,298 +85,168 @@ class Encoder:
         self.time = time.ticks_ms()
         self.btn_fifo = Fifo(10)
         self.fifo = Fifo(50, typecode = 'i')
+        self.flag = None # ThreadSafeFlag set on every input
         self.a.irq(handler = self.handler, trigger = Pin.IRQ_RISING, hard = True)
         self.c.irq(handler = self.btn_handler_falling, trigger = Pin.IRQ_FALLING, hard = True)
         self.min = 0
         self.max = 0
-        self.normalization_value = 0
     def handler(self, pin):
         if self.b():
             self.fifo.put(-1)
         else:
             self.fifo.put(1)
+        if self.flag:
+            self.flag.set()
     def btn_handler_falling(self, pin):
         ms = time.ticks_ms()
         if time.ticks_diff(ms, self.time) > 200: ## minimum time between button signals to prevent bounceback signals 
             self.btn_fifo.put(1)
+            if self.flag:
+                self.flag.set()
         self.time = ms
 
 class Sensor:
-    def __init__(self, pin):
+    def __init__(self, pin, flag = None):
         self.fifo = Fifo(100)
         self.adc = ADC(Pin(pin, Pin.IN))
+        self.running = False
+        self.flag = flag # ThreadSafeFlag set on every sample
     def timer_start(self):
+        self.running = True
         self.timer = Piotimer(period=sample_interval, mode=Piotimer.PERIODIC, callback=self.callback)
     def callback(self, skibidi): # skibidi = dummy argument to homogenise piotimer with default micropython timer
         self.fifo.put(self.adc.read_u16())
+        if self.flag:
+            self.flag.set()
     def timer_end(self):
+        self.running = False
+        if PPG_STREAM:
+            ppg_stream.stop()
         self.timer.deinit()
         self.fifo = Fifo(100)
         
         
-class HRV:
-    def __init__(self):
-        # Data
-        self.intervals = [] #temp list for live screen data
-        self.total_intervals = [] #full list for variability calc
-        self.threshold = None
-        self.bpm = None
-        self.ppi = None
-        self.bpm_output = 0
-        # Helpers
-        self.current_peak = None
-        self.last_bpm = 0
-        # Counts
-        self.threshold_count = 0
-        self.bpm_update_count = 0
-        # Index
-        self.current_peak_index = 0
-        self.peak_previous_index = None
-        self.peak_i=0
-        
-        
-        
-    def calculate_threshold(self, point):
-            # update min-max values
-            if point < self.min_point:
-                self.min_point = point
-            if point > self.max_point:
-                self.max_point = point
-            if self.threshold_count >= 250: ## this number is how many sample between calculations of the threshold                    
-                self.threshold = (self.min_point + self.max_point) / 2
-                self.normalization_value = (oled_height-1)/(self.max_point-self.min_point) ## normalisation value to fit datapoint to oled screen
-                self.threshold_count = 0
-                self.min_point = self.max_point = point
-                if self.current_peak is None:
-                    self.current_peak = self.threshold
-            self.threshold_count += 1
-    def calculate_peaks(self, point):
-        self.bpm_update_count += 1
-        self.peak_i += 1
-        if point > self.threshold:
-            if point >= self.current_peak:
-                # Update peak and index when current is higher
-                self.current_peak = point
-                self.current_peak_index = self.peak_i
-        else:
-            # When there are two peaks and they are not the same one then
-            # Calculate ppi, and bpm 
-            if not(self.peak_previous_index is None) and not(self.current_peak_index == self.peak_previous_index):
-                interval = (self.current_peak_index - self.peak_previous_index)  # Erotus
-#                   sec = interval*sample_interval/1000 # 4 is the ammount of ms pass for every point retrieved and the division of 1000 is ms to seconds  # Seconds
-                ppi = interval*sample_interval #
-                minutes = (interval*sample_interval/1000)/60 # 4 is the ammount of ms pass for every point retrieved and the division of 1000 is ms to seconds  # Seconds
-                bpm = 1/minutes
-                
-                self.intervals.append(interval)
-                                
-                if self.bpm_update_count >= 250*5: ## 250 samples = 1 second, 5 seconds
-                    total = 0
-                    if self.intervals: ##check if list exists to avoid dividing by zero
-                        print("total samples: ",len(self.intervals))
-                        print("average heartrate pre_correction: ", (60 * 1000) / sample_interval / (sum(self.intervals) / len(self.intervals)))
-                    
-                    self.intervals = [i for i in self.intervals if 75 < i < 375] ## Make list out of all usable intervals (75-500*4 ms)
-                    
-                    print("Usable samples: ",len(self.intervals))
-                    
-                    if self.intervals: ##check if list exists to avoid dividing by zero
-                        self.bpm_output = (60 * 1000) / sample_interval / (sum(self.intervals) / len(self.intervals)) ## one minute in ms divided by the average ppi
-                        
-                        print("average heartrate post_correction: ", (60 * 1000) / sample_interval / (sum(self.intervals) / len(self.intervals)))
-                        print("")
-                        
-                    self.intervals = []
-                    self.bpm_update_count = 0
-                
-            self.current_peak = self.threshold
-            self.peak_previous_index = self.current_peak_index
-            
-    def analyze_peaks(self, point):
-        self.bpm_update_count += 1
-        self.peak_i += 1
-        if point > self.threshold:
-            if point >= self.current_peak:
-                # Update peak and index when current is higher
-                self.current_peak = point
-                self.current_peak_index = self.peak_i
-        else:
-            # When there are two peaks and they are not the same one then
-            # Calculate ppi, and bpm 
-            if not(self.peak_previous_index is None) and not(self.current_peak_index == self.peak_previous_index):
-                interval = (self.current_peak_index - self.peak_previous_index)  # Erotus
-#                   sec = interval*sample_interval/1000 # 4 is the ammount of ms pass for every point retrieved and the division of 1000 is ms to seconds  # Seconds
-                #ppi = interval*sample_interval #
-                #minutes = (interval*sample_interval/1000)/60 # 4 is the ammount of ms pass for every point retrieved and the division of 1000 is ms to seconds  # Seconds
-                #bpm = 1/minutes
-                
-                self.intervals.append(interval)
-                self.total_intervals.append(interval)
-                                
-                if self.bpm_update_count >= 250*5: ## 250 samples = 1 second, 5 seconds
-                    total = 0
-                    if self.intervals: ##check if list exists to avoid dividing by zero
-                        print("total samples: ",len(self.intervals))
-                        print("average heartrate pre_correction: ", (60 * 1000) / sample_interval / (sum(self.intervals) / len(self.intervals)))
-                    
-                    self.intervals = [i for i in self.intervals if 75 < i < 375] ## Make list out of all usable intervals (75-500*4 ms)
-                    
-                    print("Usable samples: ",len(self.intervals))
-                    
-                    if self.intervals: ##check if list exists to avoid dividing by zero
-                        self.bpm_output = (60 * 1000) / sample_interval / (sum(self.intervals) / len(self.intervals)) ## one minute in ms divided by the average ppi
-                        
-                        print("average heartrate post_correction: ", (60 * 1000) / sample_interval / (sum(self.intervals) / len(self.intervals)))
-                        print("")
-                    
-                    self.intervals = []
-                    self.bpm_update_count = 0
-                
-            self.current_peak = self.threshold
-            self.peak_previous_index = self.current_peak_index
-        
+class HRV(hrv_core.HRV):
     def analyze_variability(self):
-        self.total_intervals = [i for i in self.total_intervals if 75 < i < 375]
-        
-        if len(self.total_intervals) < 1:
+        if super().analyze_variability():
             return True
-        
-        mean_ppi = (sum(self.total_intervals) * 4) / len(self.total_intervals)
-        #mean_ppi = sample_interval / (sum(self.total_intervals) / len(self.total_intervals)) ## one minute in ms divided by the average ppi
 
-        mean_hr = (60 * 1000) / sample_interval / (sum(self.total_intervals) / len(self.total_intervals)) ## one minute in ms divided by the average ppi
-
-        #mean_hr = 0
-        #for interval in self.total_intervals:
-        #    mean_hr += (interval*4)/1000/60
-        #mean_hr /= len(self.total_intervals)
-        #mean_hr = sum(self.total_intervals) * 4 / 1000 / 60 / len(self.total_intervals)
-        
-        sdnn = 0 ##standard deviation of peak to peak interval length
-        for interval in self.total_intervals:
-            sdnn += (interval-mean_ppi)**2
-        sdnn /= len(self.total_intervals)-1
-        sdnn **= (1/2)
-        
-        rmssd = 0 #root mean square of successive differences of peak to 
-        for i in range(len(self.total_intervals)-1):
-            rmssd += (self.total_intervals[i+1]-self.total_intervals[i])**2
-            
-        rmssd /= len(self.total_intervals)-1
-        
-        rmssd **= (1/2)
-        
-        timestamp = time.localtime()
-        
-        self.analysis_results = {
-            "id": time.time(),
-            "timestamp": f"{timestamp[2]}.{timestamp[1]}.{timestamp[0]} {timestamp[3]}.{timestamp[4]}",
-            "mean_ppi": int(mean_ppi),
-            "mean_hr" : int(mean_hr),
-            "sdnn" : int(sdnn),
-            "rmssd" : int(rmssd)
-        }
-        print(self.analysis_results)
-        try:
-            mqtt_client=self.connect_mqtt()
-
-        except Exception as e:
-            print(f"Failed to connect to MQTT: {e}")
-
-        try:
-            # Sending a message every 5 seconds.
-            topic = "hr-data"
-            message = json.dumps(self.analysis_results)
-            mqtt_client.publish(topic, message)
-            print(f"Sending to MQTT: {topic} -> {message}")
-            
-        except Exception as e:
-            print(f"Failed to send MQTT message: {e}")
         self.analysis_results["type"] = "local"
+        results_log.append(self.analysis_results)
+        results_log.flush(mqtt)
         
-        #print(self.analysis_results["timestamp"])
     def kubios_analysis(self):
-        self.total_intervals = [int(value*4) for value in self.total_intervals if 75 < value < 375]
-        if len(self.total_intervals) < 10:
+        # Starts the Kubios round trip, the UI polls self.kubios for the reply
+        if len(self.total_intervals) < 10: ## only usable intervals are kept
             return True
-        print(self.total_intervals)
+        ppi = [value*sample_interval for value in self.total_intervals]
+        print(ppi)
+        self.kubios = KubiosRequest(mqtt)
+        return not self.kubios.start(ppi)
 
-        kubios_request_id = time.time()
-        
-        self.kubios_analysis_results ={
-            "id": kubios_request_id,
+    def kubios_done(self):
+        self.analysis_results = self.kubios.results
+        self.analysis_results["type"] = "kubios"
+        results_log.append(self.analysis_results)
+        results_log.flush(mqtt)
+
+class KubiosRequest:
+    # One Kubios cloud analysis. start() publishes the request and returns
+    # right away, the reply arrives through the shared MQTT session that the
+    # UI loop polls, and poll() tells the waiting screen how far along it is.
+    PENDING = 0
+    DONE = 1
+    FAILED = 2
+    TIMEOUT = 3
+    # result key -> key in the Kubios analysis, all must be numbers
+    VALUES = (
+        ("mean_hr", "mean_hr_bpm"),
+        ("mean_ppi", "mean_rr_ms"),
+        ("rmssd", "rmssd_ms"),
+        ("sdnn", "sdnn_ms"),
+        ("sns", "sns_index"),
+        ("pns", "pns_index")
+    )
+
+    def __init__(self, session, timeout=KUBIOS_TIMEOUT):
+        self.session = session
+        self.timeout = timeout # ms
+        self.state = self.FAILED
+        self.results = None
+        self.id = None
+        self.started = time.ticks_ms()
+
+    def start(self, ppi):
+        self.id = time.time()
+        request = {
+            "id": self.id,
             "type" : "PPI",
-            "data" : self.total_intervals,
+            "data" : ppi,
             "analysis": {"type": "readiness"}
         }
-        
-        try:
-            mqtt_client=self.connect_mqtt()
+        self.session.subscribe("kubios-response", self.message_callback)
+        topic = "kubios-request"
+        message = json.dumps(request)
+        if not self.session.publish(topic, message):
+            self.state = self.FAILED
+            return False
+        print(f"Sending to MQTT: {topic} -> {message}")
+        self.started = time.ticks_ms()
+        self.state = self.PENDING
+        return True
 
-        except Exception as e:
-            print(f"Failed to connect to MQTT: {e}")
+    def elapsed(self):
+        return time.ticks_diff(time.ticks_ms(), self.started)
 
-        try:
-            # Sending a message every 5 seconds.
-            topic = "kubios-request"
-            message = json.dumps(self.kubios_analysis_results)
-            mqtt_client.publish(topic, message)
-            received_kubios_message = ""
-            print(f"Sending to MQTT: {topic} -> {message}")
-            self.analysis_results = {}
-            while not len(self.analysis_results):
-                mqtt_client.check_msg()
-                time.sleep_ms(25)
-            mqtt_client.publish("hr-data", json.dumps(self.analysis_results))
-            self.analysis_results["type"] = "kubios"
-                
-        except Exception as e:
-            print(f"Failed to send MQTT message: {e}")
-            
-            
-        mean_ppi = (sum(self.total_intervals) * 4) / len(self.total_intervals)
-        
+    def poll(self):
+        if self.state == self.PENDING and self.elapsed() > self.timeout:
+            self.state = self.TIMEOUT
+        return self.state
 
-    def connect_mqtt(self):
-        mqtt_client=MQTTClient("1", BROKER_IP, port=BROKER_PORT)
-        mqtt_client.set_callback(self.message_callback)
-        mqtt_client.connect(clean_session=True)
-        mqtt_client.subscribe("kubios-response")
-        return mqtt_client
-    
     def message_callback(self, topic, msg):
         print("Received message on topic:", topic.decode())
         print("Message:", msg.decode())
-        payload = json.loads(msg.decode())
-        
-        if not payload:
+        if self.state != self.PENDING:
+            return
+        try:
+            payload = json.loads(msg.decode())
+        except ValueError:
             return
-        
 
-        payload = json.loads(msg.decode())    # if msg is bytes
+        # valid JSON that is not an object cannot be a reply
+        if not isinstance(payload, dict):
+            self.state = self.FAILED
+            return
 
-        # 2) Extract the top‐level id
-        analysis_id = payload.get("id")
+        # replies to other requests (or other devices) are not ours
+        if payload.get("id") != self.id:
+            return
+
+        # Drill into the nested analysis object
+        data = payload.get("data")
+        analysis = data.get("analysis") if isinstance(data, dict) else None
+        if not isinstance(analysis, dict) or not analysis:
+            self.state = self.FAILED
+            return
 
-        # 3) Drill into the nested analysis object
-        analysis = payload.get("data", {}) \
-                          .get("analysis", {})
-        
         timestamp = time.localtime()
-        
-        self.analysis_results = {
+
+        results = {
             "id": payload.get("id"),
             "timestamp": f"{timestamp[2]}.{timestamp[1]}.{timestamp[0]} {timestamp[3]}.{timestamp[4]}",
             #"timestamp": analysis.get("create_timestamp"),
-            "mean_hr" : analysis.get("mean_hr_bpm"),
-            "mean_ppi": analysis.get("mean_rr_ms"),
-            "rmssd" : analysis.get("rmssd_ms"),
-            "sdnn" : analysis.get("sdnn_ms"),
-            "sns" : analysis.get("sns_index"),
-            "pns" : analysis.get("pns_index")
         }
-        
-        
+        # the result screen formats every value as a number, a reply
+        # missing one of them counts as a failed analysis
+        for key, kubios_key in self.VALUES:
+            value = analysis.get(kubios_key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+                self.state = self.FAILED
+                return
+            results[key] = value
+        self.results = results
+        self.state = self.DONE
+
 class Cursor:
     def __init__(self, cap = (0, 0), increment = 1, position = 0):
         self.position = position
@@ -376,15 +272,25 @@ class UI:
         self.SW_0 = Pin(pin_sw_0, mode = Pin.IN, pull = Pin.PULL_UP)
         self.SW_2 = Pin(pin_sw_2, mode = Pin.IN, pull = Pin.PULL_UP)
         self.rot = encoder
-        self.sensor = Sensor(sensor_pin)
+        # Woken by the sensor and encoder interrupts and the frame tick
+        self.wake = asyncio.ThreadSafeFlag()
+        self.rot.flag = self.wake
+        self.sensor = Sensor(sensor_pin, self.wake)
         self.screen = self.menu_setup
-        self.history = []
+        self.keep_intervals = False
+        self.last_flush = time.ticks_ms()
+        self.next_frame = self.last_flush
+        self.graph = Graph()
+        self.first_frame = None # ticks_ms (since reset) of the first frame on screen
         self.reset()
         self.sample_interval = 4
         self.interval = []
         
         
     def display(self):
+        if PROFILE:
+            loop_start = time.ticks_us()
+            profiler.fifo(1, self.rot.fifo)
         while self.rot.fifo.has_data():
             y = self.rot.fifo.get()
             btn_input = int(f'{self.SW_2()}{self.SW_0()}',2)
@@ -394,11 +300,74 @@ class UI:
                 self.alt_cursor_1.directional_move(y)
             if btn_input == 1:
                 self.alt_cursor_2.directional_move(y)
-        self.screen()
-        oled.show()
+        # samples are processed on every loop, the screen is refreshed at the frame rate.
+        # A screen that hands over to another (the setup screens) is followed
+        # right away, so the next frame already shows the new screen.
+        for _ in range(4):
+            screen = self.screen
+            self.screen()
+            if self.screen is screen:
+                break
+        ms = time.ticks_ms()
+        if time.ticks_diff(ms, self.next_frame) >= 0:
+            self.next_frame = time.ticks_add(ms, FRAME_INTERVAL)
+            if PROFILE:
+                t = time.ticks_us()
+            self.measurement_render()
+            if PROFILE:
+                t1 = time.ticks_us()
+                profiler.add(prof.DRAW, time.ticks_diff(t1, t))
+            oled.show()
+            if PROFILE:
+                profiler.add(prof.SHOW, time.ticks_diff(time.ticks_us(), t1))
+            if self.first_frame is None:
+                self.first_frame = time.ticks_ms()
+                print(f"First frame {self.first_frame} ms after reset")
+        if PROFILE:
+            profiler.add(prof.LOOP, time.ticks_diff(time.ticks_us(), loop_start))
+
+    async def run(self):
+        # The UI sleeps until an interrupt or the frame tick sets the flag,
+        # network work runs in its own tasks in between
+        asyncio.create_task(self.frame_task())
+        asyncio.create_task(self.mqtt_task())
+        while True:
+            self.display()
+            await self.wake.wait()
+
+    async def frame_task(self):
+        while True:
+            await asyncio.sleep_ms(FRAME_INTERVAL)
+            self.wake.set()
+
+    async def mqtt_task(self):
+        # Connects to the broker once the WLAN is up, then handles incoming
+        # messages (Kubios replies), keep-alive pings and the upload of
+        # results queued while offline. Opening the connection waits for the
+        # broker without blocking the UI, it still never happens during a
+        # measurement so the MQTT handshake cannot delay the sampling.
+        while True:
+            await asyncio.sleep_ms(MQTT_INTERVAL)
+            if not wlan.isconnected():
+                continue
+            if not self.sensor.running:
+                await mqtt.open() # returns at once while backing off
+            mqtt.poll()
+            if PPG_STREAM:
+                ppg_stream.publish(mqtt, PPG_TOPIC)
+            ms = time.ticks_ms()
+            if not self.sensor.running and time.ticks_diff(ms, self.last_flush) > FLUSH_INTERVAL:
+                self.last_flush = ms
+                results_log.flush(mqtt)
+
+    def network_status(self):
+        # W once the WLAN is up, M once the broker is connected too
+        return ("W" if wlan.isconnected() else "-") + ("M" if mqtt.connected() else "-")
+
 #    def move(self, cursor):
     def reset(self):
         oled.fill(0)
+        oled.invalidate() ## a new screen is sent whole, which also resyncs the panel with the shadow copy
         # Cursors
         self.cursor = Cursor()
         self.alt_cursor_1 = Cursor()
@@ -406,26 +375,35 @@ class UI:
         
     def sensor_setup(self):
         # setup of peak detection and graph and threshold calculation
-        self.hrv = HRV()
-        self.graph_helper = 0
-        self.graph_i = 0
-        self.graph_frequency = 5
-        # hr graphic variables
-        self.ypos_sum = 0
-        self.ysum_i = 0
-        self.xpos = 100
-        self.lastpos = 0
+        self.hrv = HRV(self.keep_intervals)
+        self.graph.reset()
         # Timer
         self.sensor.timer_start()
-        while not self.sensor.fifo.has_data():
-            pass
-        self.hrv.min_point = self.hrv.max_point = self.sensor.fifo.get()
-        
-        while self.hrv.threshold is None:
-            if self.sensor.fifo.has_data():
-                self.hrv.calculate_threshold(self.sensor.fifo.get())   
-        self.screen = self.next_screen
+        if PPG_STREAM:
+            ppg_stream.start(self.sensor.fifo)
+        if sample_filter is not None:
+            sample_filter.reset()
+        self.started = False
+        self.screen = self.sensor_prime
         oled.fill(0)
+
+    def sensor_prime(self):
+        # Fills the threshold window with the samples that have arrived. The
+        # measurement screen starts as soon as there is a threshold and gets
+        # the samples still in the FIFO, so peak detection sees all of them.
+        while self.hrv.threshold is None and self.sensor.fifo.has_data():
+            point = self.sensor.fifo.get()
+            if PPG_STREAM:
+                ppg_stream.add(point) ## the stream gets the raw samples
+            if sample_filter is not None:
+                point = sample_filter.filter(point)
+            if not self.started:
+                self.hrv.start(point)
+                self.started = True
+            else:
+                self.hrv.calculate_threshold(point)
+        if self.hrv.threshold is not None:
+            self.screen = self.next_screen
         
     def menu_setup(self):
         self.cursor.cap = (0, 3)
@@ -437,6 +415,7 @@ class UI:
         oled.text("2.HRV analysis", 0, 10, 1)
         oled.text("3.Kubios cloud", 0, 20, 1)
         oled.text("4.History", 0, 30, 1)
+        oled.text(self.network_status(), 112, 56, 1)
         oled.rect(0, self.cursor.position*10, 12, 8, 0, True)
         oled.text("->", 0, self.cursor.position*10, 1)
         
@@ -454,6 +433,9 @@ class UI:
                 self.screen = self.kubios_start_screen
             if self.cursor.position == 3:
                 self.screen = self.history_setup
+            if PROFILE:
+                if not self.SW_2():
+                    self.screen = self.debug_setup
             self.reset()
         
     def heart_rate_start_screen(self):
@@ -464,31 +446,56 @@ class UI:
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
             self.next_screen = self.heart_rate_screen
+            self.keep_intervals = False
+            self.collecting = False
             self.screen = self.sensor_setup
         
-    def heart_rate_screen(self):
+    def process_samples(self, peaks):
+        # Sample stage: drains the sensor FIFO as fast as samples arrive.
+        # Drawing is left to measurement_render at the frame rate.
+        hrv = self.hrv
+        if PROFILE:
+            profiler.fifo(0, self.sensor.fifo)
+            drain_start = time.ticks_us()
+            drained = False
         while self.sensor.fifo.has_data():
             point = self.sensor.fifo.get()
-            self.hrv.calculate_threshold(point)
-            self.hrv.calculate_peaks(point)
-            # Display
-            oled.rect(102,0, 28, 20, 0, 1)
-            oled.text(f"{int(self.hrv.bpm_output)}",102,0,1)
+            if PPG_STREAM:
+                ppg_stream.add(point)
+            if sample_filter is not None:
+                point = sample_filter.filter(point)
+            if PROFILE:
+                drained = True
+                t = time.ticks_us()
+            hrv.calculate_threshold(point)
+            if PROFILE:
+                t1 = time.ticks_us()
+                profiler.add(prof.THRESHOLD, time.ticks_diff(t1, t))
+            peaks(point)
+            if PROFILE:
+                profiler.add(prof.PEAKS, time.ticks_diff(time.ticks_us(), t1))
+            self.graph.add(point, hrv.min_point, hrv.max_point)
+        if PROFILE:
+            if drained:
+                profiler.add(prof.DRAIN, time.ticks_diff(time.ticks_us(), drain_start))
+
+    def measurement_render(self):
+        # Render stage: scrolls in the graph columns collected since the
+        # last frame and draws the latest BPM
+        if not self.sensor.running:
+            return
+        #Scrolling graph
+        self.graph.draw(oled)
+        #text
+        oled.rect(102,0, 28, 20, 0, 1)
+        oled.text(f"{int(self.hrv.bpm_output)}",102,0,1)
+        if self.collecting:
+            oled.text("Collecting data",5,50,1)
+        else:
             oled.text("BPM",102,10,1)
-            #oled.pixel( self.xpos, transform(point, self.hrv.normalization_value, 0), 1)
-            self.ypos_sum += transform(point-self.hrv.min_point, self.hrv.normalization_value*0.6, -20)
-            self.ysum_i += 1
-            if self.ysum_i > 6:
-                current_ypos = int((self.ypos_sum / 7))
-                oled.line(self.xpos, 0,self.xpos, 64, 0)
-                oled.line(self.xpos-1, 0,self.xpos-1, 64, 0)
-                oled.line(self.xpos+1,self.lastpos,self.xpos,current_ypos, 1)
-                self.lastpos = current_ypos
-                self.ypos_sum = 0
-                self.ysum_i = 0
-                self.xpos -= 1
-            if self.xpos < 0:
-                self.xpos = 100
+
+    def heart_rate_screen(self):
+        self.process_samples(self.hrv.calculate_peaks)
             
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
@@ -506,6 +513,8 @@ class UI:
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
             self.next_screen = self.analysis_setup
+            self.keep_intervals = True
+            self.collecting = True
             self.screen = self.sensor_setup
             
     def analysis_setup(self):
@@ -513,30 +522,7 @@ class UI:
         self.screen = self.analysis_screen
         
     def analysis_screen(self):
-        while self.sensor.fifo.has_data():
-            point = self.sensor.fifo.get()
-            self.hrv.calculate_threshold(point)
-            self.hrv.analyze_peaks(point)
-            # Display
-            oled.rect(102,0, 28, 20, 0, 1)
-                #Scrolling graph
-            self.ypos_sum += transform(point-self.hrv.min_point, self.hrv.normalization_value*0.6, -20)
-            self.ysum_i += 1
-            if self.ysum_i > 6:
-                current_ypos = int((self.ypos_sum / 7))
-                oled.line(self.xpos, 0,self.xpos, 64, 0)
-                oled.line(self.xpos-1, 0,self.xpos-1, 64, 0)
-                oled.line(self.xpos+1,self.lastpos,self.xpos,current_ypos, 1)
-                self.lastpos = current_ypos
-                self.ypos_sum = 0
-                self.ysum_i = 0
-                self.xpos -= 1
-            if self.xpos < 0:
-                self.xpos = 100
-                
-                #text
-            oled.text(f"{int(self.hrv.bpm_output)}",102,0,1)
-            oled.text("Collecting data",5,50,1)
+        self.process_samples(self.hrv.analyze_peaks)
             
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
@@ -545,26 +531,31 @@ class UI:
         ms = time.ticks_ms()
         if time.ticks_diff(ms, self.time) > 30000:
             self.screen = self.analysis_result_setup
-        
-        while self.rot.btn_fifo.has_data():
-            self.rot.btn_fifo.get()
-            self.sensor.timer_end()
-            self.screen = self.menu_setup
-    
+
     def analysis_result_setup(self):
         self.sensor.timer_end()
         if self.hrv.analyze_variability():
             self.screen = self.measurement_error
             return
-        self.history.append(self.hrv.analysis_results)
         self.screen = self.analysis_result
     
     def analysis_result(self):
+        results = self.hrv.analysis_results
         oled.fill(0)
-        oled.text(f"mean ppi: {self.hrv.analysis_results["mean_ppi"]:.2f}",2,0,1)
-        oled.text(f"mean hr: {self.hrv.analysis_results["mean_hr"]:.2f}",2,10,1)
-        oled.text(f"RMSSD: {self.hrv.analysis_results["rmssd"]:.2f}",2,20,1)
-        oled.text(f"SDNN: {self.hrv.analysis_results["sdnn"]}",2,30,1)
+        if "lf_hf" in results:
+            # frequency domain as well, in the rows of history_result
+            oled.text(f"mean ppi: {results['mean_ppi']}",2,0,1)
+            oled.text(f"mean hr: {results['mean_hr']}",2,8,1)
+            oled.text(f"RMSSD: {results['rmssd']}",2,16,1)
+            oled.text(f"SDNN: {results['sdnn']}",2,24,1)
+            oled.text(f"LF/HF: {results['lf_hf']:.2f}",2,32,1)
+            oled.text(f"SNS~ {results['sns_est']:.2f}",2,40,1)
+            oled.text(f"PNS~ {results['pns_est']:.2f}",2,48,1)
+        else:
+            oled.text(f"mean ppi: {results['mean_ppi']:.2f}",2,0,1)
+            oled.text(f"mean hr: {results['mean_hr']:.2f}",2,10,1)
+            oled.text(f"RMSSD: {results['rmssd']:.2f}",2,20,1)
+            oled.text(f"SDNN: {results['sdnn']}",2,30,1)
         
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
@@ -574,10 +565,22 @@ class UI:
         oled.text("Start measurment", 0, 10, 1)
         oled.text("by pressing the ", 0, 20, 1)
         oled.text("rotary button", 0, 30, 1)
+        # Kubios is the only measurement that needs the network, the MQTT
+        # task connects to the broker in the background
+        online = mqtt.connected()
+        oled.rect(0, 50, 128, 8, 0, True)
+        if not wlan.isconnected():
+            oled.text("Waiting for WLAN", 0, 50, 1)
+        elif not online:
+            oled.text("Waiting for MQTT", 0, 50, 1)
         
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
+            if not online:
+                continue
             self.next_screen = self.kubios_setup
+            self.keep_intervals = True
+            self.collecting = True
             self.screen = self.sensor_setup
             
     def kubios_setup(self):
@@ -585,30 +588,7 @@ class UI:
         self.screen = self.kubios_screen
         
     def kubios_screen(self):
-        while self.sensor.fifo.has_data():
-            point = self.sensor.fifo.get()
-            self.hrv.calculate_threshold(point)
-            self.hrv.analyze_peaks(point)
-            # Display
-            oled.rect(102,0, 28, 20, 0, 1)
-                #Scrolling graph
-            self.ypos_sum += transform(point-self.hrv.min_point, self.hrv.normalization_value*0.6, -20)
-            self.ysum_i += 1
-            if self.ysum_i > 6:
-                current_ypos = int((self.ypos_sum / 7))
-                oled.line(self.xpos, 0,self.xpos, 64, 0)
-                oled.line(self.xpos-1, 0,self.xpos-1, 64, 0)
-                oled.line(self.xpos+1,self.lastpos,self.xpos,current_ypos, 1)
-                self.lastpos = current_ypos
-                self.ypos_sum = 0
-                self.ysum_i = 0
-                self.xpos -= 1
-            if self.xpos < 0:
-                self.xpos = 100
-                
-                #text
-            oled.text(f"{int(self.hrv.bpm_output)}",102,0,1)
-            oled.text("Collecting data",5,50,1)
+        self.process_samples(self.hrv.analyze_peaks)
             
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
@@ -617,57 +597,75 @@ class UI:
         ms = time.ticks_ms()
         if time.ticks_diff(ms, self.time) > 30000:
             self.screen = self.kubios_result_setup
-        
-        while self.rot.btn_fifo.has_data():
-            self.rot.btn_fifo.get()
-            self.sensor.timer_end()
-            self.screen = self.menu_setup
 
     def kubios_result_setup(self):
         self.sensor.timer_end()
         if self.hrv.kubios_analysis():
             self.screen = self.measurement_error
             return
-        print(self.hrv.analysis_results)
-        self.history.append(self.hrv.analysis_results)
-        self.screen = self.kubios_result
-    
+        oled.fill(0)
+        self.screen = self.kubios_wait
+
+    def kubios_wait(self):
+        # keeps rendering while the reply is on its way
+        state = self.hrv.kubios.poll()
+        if state == KubiosRequest.DONE:
+            self.hrv.kubios_done()
+            print(self.hrv.analysis_results)
+            self.screen = self.kubios_result
+            return
+        if state != KubiosRequest.PENDING:
+            self.screen = self.measurement_error
+            return
+        seconds = self.hrv.kubios.elapsed() // 1000
+        oled.fill(0)
+        oled.text("Waiting for", 0, 10, 1)
+        oled.text("Kubios" + "." * (seconds % 4), 0, 20, 1)
+        oled.text(f"{seconds}/{self.hrv.kubios.timeout // 1000} s", 0, 30, 1)
+        oled.text("Press to cancel", 0, 50, 1)
+
+        while self.rot.btn_fifo.has_data():
+            self.rot.btn_fifo.get()
+            self.screen = self.menu_setup
+
     def kubios_result(self):
         oled.fill(0)
-        oled.text(f"mean ppi: {int(self.hrv.analysis_results["mean_ppi"])}",2,0,1)
-        oled.text(f"mean hr: {int(self.hrv.analysis_results["mean_hr"])}",2,10,1)
-        oled.text(f"RMSSD: {int(self.hrv.analysis_results["rmssd"])}",2,20,1)
-        oled.text(f"SDNN: {int(self.hrv.analysis_results["sdnn"])}",2,30,1)
-        oled.text(f"SNS: {self.hrv.analysis_results["sns"]:.2f}",2,40,1)
-        oled.text(f"PNS: {self.hrv.analysis_results["pns"]:.2f}",2,50,1)
+        oled.text(f"mean ppi: {int(self.hrv.analysis_results['mean_ppi'])}",2,0,1)
+        oled.text(f"mean hr: {int(self.hrv.analysis_results['mean_hr'])}",2,10,1)
+        oled.text(f"RMSSD: {int(self.hrv.analysis_results['rmssd'])}",2,20,1)
+        oled.text(f"SDNN: {int(self.hrv.analysis_results['sdnn'])}",2,30,1)
+        oled.text(f"SNS: {self.hrv.analysis_results['sns']:.2f}",2,40,1)
+        oled.text(f"PNS: {self.hrv.analysis_results['pns']:.2f}",2,50,1)
         
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
             self.screen = self.menu_setup
 
     def history_setup(self):
-        self.cursor.cap = (0, len(self.history))
+        # History lives in the result log on flash, only the visible page
+        # and the opened result are loaded
+        self.list_length = results_log.count()
+        self.cursor.cap = (0, self.list_length)
+        self.history_first = None
         self.screen = self.history_list
-        self.list_length = len(self.history)
+
     def history_list(self):
+        first = 0
+        if self.cursor.position>5:
+            first = self.cursor.position-5
+        if first != self.history_first:
+            self.history_page = results_log.read(first, 5)
+            self.history_first = first
         oled.fill(0)
         oled.text("  return", 0, 0, 1)
-        if self.list_length < 5:
-            for i in range(self.list_length):
-                oled.text(f"{i+1}.Analysis", 0, 10*(i+1), 1)
-        else:
-            for i in range(5):
-                cursor = 0
-                if self.cursor.position>5:
-                    cursor = self.cursor.position-5
-                oled.text(f"{i+1+cursor}.Analysis", 0, 10*(i+1), 1)
+        for i in range(len(self.history_page)):
+            kind = "Kubios" if self.history_page[i]["type"] == "kubios" else "Analysis"
+            oled.text(f"{i+1+first}.{kind}", 0, 10*(i+1), 1)
         cursor = self.cursor.position
         if self.cursor.position>5:
             cursor = 5
         oled.rect(0, cursor*10, 12, 8, 0, True)
         oled.text("->", 0, cursor*10, 1)
-        print(self.cursor.position)
-        print(cursor)
         self.analysis_selected = self.cursor.position-1
         
         while self.rot.btn_fifo.has_data():
@@ -675,26 +673,57 @@ class UI:
             if self.analysis_selected == -1:
                 self.screen = self.menu_setup
             else:
+                self.selected = self.history_page[self.analysis_selected - first]
                 self.screen = self.history_result
 
     def history_result(self):
         oled.fill(0)
-        selected = self.history[self.analysis_selected]
-        print(self.history[self.analysis_selected])
+        selected = self.selected
         oled.text(selected["timestamp"],4,0,1)
-        oled.text(f"mean ppi: {int(selected["mean_ppi"])}",0,8,1)
-        oled.text(f"mean hr: {int(selected["mean_hr"])}",0,16,1)
-        oled.text(f"RMSSD: {int(selected["rmssd"])}",0,24,1)
-        oled.text(f"SDNN: {int(selected["sdnn"])}",0,32,1)
-        if selected["type"] == "kubios":
-            oled.text(f"SNS: {selected["sns"]:.2f}",0,40,1)
-            oled.text(f"PNS: {selected["pns"]:.2f}",0,48,1)
+        oled.text(f"mean ppi: {int(selected['mean_ppi'])}",0,8,1)
+        oled.text(f"mean hr: {int(selected['mean_hr'])}",0,16,1)
+        oled.text(f"RMSSD: {int(selected['rmssd'])}",0,24,1)
+        oled.text(f"SDNN: {int(selected['sdnn'])}",0,32,1)
+        if "sns_est" in selected: ## local analyses have estimates
+            oled.text(f"SNS~ {selected['sns_est']:.2f}",0,40,1)
+            oled.text(f"PNS~ {selected['pns_est']:.2f}",0,48,1)
+        elif "sns" in selected:
+            oled.text(f"SNS: {selected['sns']:.2f}",0,40,1)
+            oled.text(f"PNS: {selected['pns']:.2f}",0,48,1)
             
         
         while self.rot.btn_fifo.has_data():
             self.rot.btn_fifo.get()
             self.screen = self.history_setup
             
+    def debug_setup(self):
+        self.cursor.cap = (0, 1)
+        self.screen = self.debug_screen
+
+    def debug_screen(self):
+        # Profiling results: turn for the second page, press to publish them
+        # on "hr-profile" and return to the menu
+        oled.fill(0)
+        if self.cursor.position == 0:
+            lines = profiler.lines()
+        else:
+            lines = ["fifo   max drop"] + profiler.fifo_lines()
+            lines.append(f"frames {oled.frames}")
+            lines.append(f"unchgd {oled.skipped}")
+            lines.append(f"kB out {oled.bytes_sent // 1024}")
+            lines.append(f"mqtt {mqtt.connects}/{mqtt.failures}")
+            lines.append(f"ttff {self.first_frame} ms")
+        for i in range(len(lines)):
+            oled.text(lines[i], 0, i * 8, 1)
+
+        while self.rot.btn_fifo.has_data():
+            self.rot.btn_fifo.get()
+            results = profiler.results()
+            results["oled"] = {"frames": oled.frames, "skipped": oled.skipped, "bytes": oled.bytes_sent}
+            results["first_frame_ms"] = self.first_frame
+            mqtt.publish("hr-profile", json.dumps(results))
+            self.screen = self.menu_setup
+
     def measurement_error(self):
         self.sensor.timer_end()
         oled.fill(0)
@@ -708,9 +737,16 @@ class UI:
             self.screen = self.menu_setup
             self.sensor.timer_end()
 
-connect_wlan()
-rot = Encoder(10, 11, 12)
-ui = UI(rot, 27, 9, 7)
-while True:
-    ui.display()
+async def run(ui):
+    # the WLAN comes up in the background while the UI runs
+    asyncio.create_task(connect_wlan())
+    await ui.run()
+
+def main():
+    rot = Encoder(10, 11, 12)
+    ui = UI(rot, 27, 9, 7)
+    asyncio.run(run(ui))
+
+if __name__ == "__main__":
+    main()
 
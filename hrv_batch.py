@@ -0,0 +1,147 @@
+import sys
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from capture import iter_chunks
+from hrv_core import (HRV, sample_interval, threshold_window, interval_low, interval_high,
+                      bpm_window_beats, bpm_window_seconds)
+
+# Vectorized version of the streaming HRV path for host-side processing of
+# whole captures. analyze() gives the same peaks and intervals as feeding the
+# samples one by one through replay.replay() with the sliding threshold.
+
+def load_samples(path):
+    chunks = [np.frombuffer(samples, dtype=np.uint16) for samples in iter_chunks(path)]
+    if not chunks:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(chunks).astype(np.int64)
+
+def thresholds(samples, window=threshold_window):
+    # threshold after each sample once the first window has filled, i.e. for
+    # samples window-1 onwards
+    windows = sliding_window_view(samples, window)
+    return (windows.min(axis=1) + windows.max(axis=1)) / 2
+
+def detect_peaks(points, threshold, initial_peak):
+    # Peak indices (1-based, counted like HRV.peak_i) whose intervals the
+    # streaming detector reports. An above-threshold run ends at the next
+    # sample at or below the threshold; its peak is the last occurrence of
+    # its maximum, provided that maximum reaches the threshold at the start
+    # of the run (the streaming detector's reset value for current_peak).
+    below = np.flatnonzero(points <= threshold)
+    if not len(below):
+        return np.zeros(1, dtype=np.int64)
+    last = below[-1] + 1
+    starts = np.concatenate(([0], below[:-1] + 1))
+    masked = np.where(points[:last] > threshold[:last], points[:last], -1)
+    run_max = np.maximum.reduceat(masked, starts)
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, last)))
+    position = np.where(masked == run_max[segment], np.arange(last), -1)
+    run_last = np.maximum.reduceat(position, starts)
+    reference = np.concatenate(([initial_peak], threshold[below[:-1]]))
+    valid = (run_max >= 0) & (run_max >= reference)
+    first = run_last[0] + 1 if valid[0] else 0
+    return np.concatenate(([first], run_last[1:][valid[1:]] + 1))
+
+def live_bpm(intervals, beats=bpm_window_beats, seconds=bpm_window_seconds):
+    # BpmWindow after the last beat
+    window = intervals[(intervals > interval_low) & (intervals < interval_high)][-beats:]
+    span = seconds * 1000 // sample_interval
+    while len(window) > 1 and window.sum() > span:
+        window = window[1:]
+    if not len(window):
+        return 0
+    return (60 * 1000) / sample_interval / (window.sum() / len(window))
+
+def analyze(samples, window=threshold_window):
+    samples = np.asarray(samples, dtype=np.int64)
+    results = {"samples": len(samples), "peaks": np.zeros(0, dtype=np.int64),
+               "intervals": np.zeros(0, dtype=np.int64), "bpm": 0,
+               "count": 0, "rejected": 0}
+    if len(samples) <= window:
+        return results
+    threshold = thresholds(samples, window)
+    # sample window-1 only sets the threshold, detection starts after it
+    peaks = detect_peaks(samples[window:], threshold[1:], threshold[0])
+    intervals = np.diff(peaks)
+    usable = intervals[(intervals > interval_low) & (intervals < interval_high)]
+    results["peaks"] = peaks[1:] + window - 1 ## index into samples
+    results["intervals"] = intervals
+    results["bpm"] = live_bpm(intervals)
+    results["count"] = len(usable)
+    results["rejected"] = len(intervals) - len(usable)
+    if len(usable) >= 2:
+        mean = usable.mean()
+        results["mean_ppi"] = mean * sample_interval
+        results["mean_hr"] = (60 * 1000) / (mean * sample_interval)
+        results["sdnn"] = usable.std(ddof=1) * sample_interval
+        results["rmssd"] = np.sqrt((np.diff(usable) ** 2).sum() / (len(usable) - 1)) * sample_interval
+    return results
+
+def stream(samples):
+    # the same capture through the per-sample HRV path
+    from replay import replay
+    hrv = HRV(keep_intervals=True)
+    hrv.verbose = False
+    intervals = []
+    analyze_interval = hrv.analyze_interval
+    def record(interval):
+        intervals.append(interval)
+        analyze_interval(interval)
+    hrv.analyze_interval = record
+    replay((int(x) for x in samples), hrv)
+    return hrv, intervals
+
+def check(path):
+    # Intervals, counts and the live BPM must match exactly, the statistics
+    # only differ by the summation order of Welford's update vs numpy.
+    samples = load_samples(path)
+    batch = analyze(samples)
+    hrv, intervals = stream(samples)
+    errors = []
+    if batch["intervals"].tolist() != intervals:
+        errors.append("intervals differ")
+    if batch["count"] != hrv.stats.count or batch["rejected"] != hrv.stats.rejected:
+        errors.append("interval counts differ")
+    if batch["bpm"] != hrv.bpm_output:
+        errors.append(f"bpm {batch['bpm']} != {hrv.bpm_output}")
+    if hrv.stats.count >= 2:
+        for key in ("mean_ppi", "mean_hr", "sdnn", "rmssd"):
+            expected = getattr(hrv.stats, key)()
+            if abs(batch[key] - expected) > 1e-9 * max(1, abs(expected)):
+                errors.append(f"{key} {batch[key]} != {expected}")
+    return errors
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Vectorized HRV analysis of whole captures")
+    parser.add_argument("captures", nargs="+", help="capture files")
+    parser.add_argument("--check", action="store_true", help="assert equivalence with the streaming HRV path")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failed = 0
+        for path in args.captures:
+            errors = check(path)
+            print(f"{path}: {'; '.join(errors) if errors else 'ok'}")
+            failed += bool(errors)
+        return 1 if failed else 0
+
+    total = 0
+    start = time.perf_counter()
+    for path in args.captures:
+        results = analyze(load_samples(path))
+        total += results["samples"]
+        line = f"{path}: {results['count']} usable, {results['rejected']} rejected, bpm {results['bpm']:.1f}"
+        if "sdnn" in results:
+            line += f", mean ppi {results['mean_ppi']:.0f} ms, sdnn {results['sdnn']:.1f} ms, rmssd {results['rmssd']:.1f} ms"
+        print(line)
+    elapsed = time.perf_counter() - start
+    if elapsed > 0:
+        print(f"{total} samples in {elapsed * 1000:.1f} ms ({total / elapsed:.0f} samples/s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+from array import array
+import sys
+import time
+import hrv_freq
+import detector
+
+# Signal processing core of the HRV monitor. Nothing in here touches the
+# hardware so the same detector runs on the Pico and on a normal CPython.
+
+sample_interval = 4 # ms between samples (250 Hz)
+max_recording = 300 # s, longest measurement whose intervals are kept
+threshold_window = 250 # samples the threshold min-max window spans (1 s)
+interval_low = 75 ## usable intervals are interval_low < i < interval_high samples (300-1500 ms)
+interval_high = 375
+bpm_window_beats = 10 # live BPM is the mean of at most this many recent beats
+bpm_window_seconds = 5 # ...spanning at most this many seconds
+# The integer kernel of detector.py is meant for the viper emitter. On
+# CPython it is slower than the methods, so host tools use those.
+use_kernel = sys.implementation.name == "micropython"
+
+class IntervalBuffer:
+    # Ring buffer of intervals on a preallocated array, in the spirit of the
+    # pico-lib Fifo. When full the oldest interval is overwritten. Appending
+    # and removing work in place so the sampling loop never allocates.
+    def __init__(self, size, typecode = 'H'):
+        self.data = array(typecode)
+        for i in range(size):
+            self.data.append(0)
+        self.size = size
+        self.head = 0 ## index of the oldest interval
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError("interval index out of range")
+        if i < 0:
+            i += self.count
+        return self.data[(self.head + i) % self.size]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.data[(self.head + i) % self.size]
+
+    def append(self, value):
+        if self.count < self.size:
+            self.data[(self.head + self.count) % self.size] = value
+            self.count += 1
+        else:
+            self.data[self.head] = value
+            self.head = (self.head + 1) % self.size
+
+    def pop_oldest(self):
+        value = self.data[self.head]
+        self.head = (self.head + 1) % self.size
+        self.count -= 1
+        return value
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+class SlidingMinMax:
+    # Minimum and maximum of the latest `window` samples using two monotonic
+    # deques kept in preallocated arrays, amortized O(1) per sample.
+    def __init__(self, window):
+        self.window = window
+        self.max_index = array('i')
+        self.max_value = array('i')
+        self.min_index = array('i')
+        self.min_value = array('i')
+        for i in range(window):
+            self.max_index.append(0)
+            self.max_value.append(0)
+            self.min_index.append(0)
+            self.min_value.append(0)
+        self.reset()
+
+    def reset(self):
+        self.i = 0 ## samples added
+        self.max_head = self.max_len = 0
+        self.min_head = self.min_len = 0
+
+    def add(self, point):
+        window = self.window
+        i = self.i
+        # drop values from the back that can no longer be the max/min
+        while self.max_len and self.max_value[(self.max_head + self.max_len - 1) % window] <= point:
+            self.max_len -= 1
+        while self.min_len and self.min_value[(self.min_head + self.min_len - 1) % window] >= point:
+            self.min_len -= 1
+        # drop the front once it slides out of the window
+        if self.max_len and self.max_index[self.max_head] <= i - window:
+            self.max_head = (self.max_head + 1) % window
+            self.max_len -= 1
+        if self.min_len and self.min_index[self.min_head] <= i - window:
+            self.min_head = (self.min_head + 1) % window
+            self.min_len -= 1
+        tail = (self.max_head + self.max_len) % window
+        self.max_index[tail] = i
+        self.max_value[tail] = point
+        self.max_len += 1
+        tail = (self.min_head + self.min_len) % window
+        self.min_index[tail] = i
+        self.min_value[tail] = point
+        self.min_len += 1
+        self.i = i + 1
+
+    def full(self):
+        return self.i >= self.window
+
+    def max(self):
+        return self.max_value[self.max_head]
+
+    def min(self):
+        return self.min_value[self.min_head]
+
+class BpmWindow:
+    # Live heart rate over a sliding window of the latest usable beats. The
+    # window holds at most `beats` intervals and at most `seconds` worth of
+    # them; the running total makes every update constant time.
+    def __init__(self, beats=bpm_window_beats, seconds=bpm_window_seconds, low=interval_low, high=interval_high):
+        self.window = IntervalBuffer(beats)
+        self.span = seconds * 1000 // sample_interval ## window length in samples
+        self.low = low
+        self.high = high
+        self.total = 0
+
+    def add(self, interval):
+        if not (self.low < interval < self.high):
+            return False
+        window = self.window
+        if len(window) == window.size:
+            self.total -= window[0]
+        window.append(interval)
+        self.total += interval
+        while self.total > self.span and len(window) > 1:
+            self.total -= window.pop_oldest()
+        return True
+
+    def bpm(self):
+        if not len(self.window):
+            return 0
+        return (60 * 1000) / sample_interval / (self.total / len(self.window)) ## one minute in ms divided by the average ppi
+
+class RunningStats:
+    # Interval statistics updated one interval at a time, so the results are
+    # available at any moment and memory does not grow with the length of
+    # the measurement. Only integer sums are kept (intervals, their squares
+    # and the squared successive differences), which stay small ints for a
+    # max_recording measurement: a beat allocates nothing and the results
+    # are exact. Intervals are in samples, results in ms.
+    def __init__(self, low=interval_low, high=interval_high):
+        self.low = low
+        self.high = high
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.rejected = 0
+        self.total = 0 ## sum of the intervals
+        self.squares = 0 ## sum of the squared intervals
+        self.ssd = 0 ## sum of squared successive differences
+        self.last = None
+
+    def add(self, interval):
+        if not (self.low < interval < self.high):
+            self.rejected += 1
+            return False
+        self.count += 1
+        self.total += interval
+        self.squares += interval * interval
+        if self.last is not None:
+            diff = interval - self.last
+            self.ssd += diff * diff
+        self.last = interval
+        return True
+
+    def mean_ppi(self):
+        return self.total * sample_interval / self.count
+
+    def mean_hr(self):
+        return (60 * 1000) * self.count / (self.total * sample_interval)
+
+    def sdnn(self):
+        # sample variance (n * sum x^2 - (sum x)^2) / (n (n - 1)), exact up
+        # to the one division
+        n = self.count
+        return ((n * self.squares - self.total * self.total) / (n * (n - 1))) ** 0.5 * sample_interval
+
+    def rmssd(self):
+        return (self.ssd / (self.count - 1)) ** 0.5 * sample_interval
+
+    def results(self):
+        # None until there are enough intervals for SDNN and RMSSD
+        if self.count < 2:
+            return None
+        return {
+            "mean_ppi": int(self.mean_ppi()),
+            "mean_hr" : int(self.mean_hr()),
+            "sdnn" : int(self.sdnn()),
+            "rmssd" : int(self.rmssd())
+        }
+
+class HRV:
+    def __init__(self, keep_intervals=False, window=threshold_window, block_threshold=False, kernel=use_kernel):
+        # Data
+        self.total_intervals = None #usable intervals, only kept when the whole series is needed (Kubios, frequency domain)
+        if keep_intervals:
+            self.total_intervals = IntervalBuffer(max_recording * 1000 // sample_interval // interval_low)
+        self.stats = RunningStats()
+        self.bpm_window = BpmWindow()
+        self.threshold = None
+        self.bpm_output = 0
+        self.min_point = None
+        self.max_point = None
+        self.kernel = kernel and not block_threshold
+        if not self.kernel:
+            self.minmax = SlidingMinMax(window)
+        if block_threshold:
+            # original threshold, recalculated once per window
+            self.calculate_threshold = self.calculate_block_threshold
+        elif kernel:
+            # the integer kernel of detector.py instead of the methods
+            # below, which stay as the reference
+            self.state = detector.new_state(window)
+            self.queues = detector.new_queues(window)
+            self.calculate_threshold = self.kernel_threshold
+            self.calculate_peaks = self.kernel_calculate_peaks
+            self.analyze_peaks = self.kernel_analyze_peaks
+        # Helpers
+        self.current_peak = None
+        self.verbose = True
+        # Counts
+        self.threshold_count = 0
+        # Index
+        self.current_peak_index = 0
+        self.peak_previous_index = None
+        self.peak_i=0
+
+    def start(self, point):
+        # first sample of a measurement seeds the min-max window
+        self.min_point = self.max_point = point
+        if self.kernel:
+            detector.start(self.state, self.queues, point)
+            return
+        self.minmax.reset()
+        self.minmax.add(point)
+
+    def calculate_threshold(self, point):
+        # Threshold halfway between the min and max of the latest window of
+        # samples, updated on every sample once the window has filled
+        minmax = self.minmax
+        minmax.add(point)
+        if minmax.full():
+            self.min_point = minmax.min()
+            self.max_point = minmax.max()
+            self.threshold = (self.min_point + self.max_point) / 2
+            if self.current_peak is None:
+                self.current_peak = self.threshold
+
+    def kernel_threshold(self, point):
+        # calculate_threshold() on the kernel, the attributes only change
+        # with the min or max of the window. The kernel compares against the
+        # exact doubled threshold and keeps its own current peak, threshold
+        # is rounded down and only tells the UI that priming is done.
+        if detector.track(self.state, self.queues, point):
+            state = self.state
+            self.min_point = state[detector.LOW]
+            self.max_point = state[detector.HIGH]
+            self.threshold = (self.min_point + self.max_point) // 2
+
+    def calculate_block_threshold(self, point):
+            # update min-max values
+            if point < self.min_point:
+                self.min_point = point
+            if point > self.max_point:
+                self.max_point = point
+            if self.threshold_count >= 250: ## this number is how many sample between calculations of the threshold
+                self.threshold = (self.min_point + self.max_point) / 2
+                self.threshold_count = 0
+                self.min_point = self.max_point = point
+                if self.current_peak is None:
+                    self.current_peak = self.threshold
+            self.threshold_count += 1
+
+    def detect_peak(self, point):
+        # Returns the interval in samples between the last two peaks when a
+        # peak ends on this sample, otherwise 0
+        interval = 0
+        self.peak_i += 1
+        if point > self.threshold:
+            if point >= self.current_peak:
+                # Update peak and index when current is higher
+                self.current_peak = point
+                self.current_peak_index = self.peak_i
+        else:
+            # When there are two peaks and they are not the same one then
+            # Calculate ppi
+            if not(self.peak_previous_index is None) and not(self.current_peak_index == self.peak_previous_index):
+                interval = (self.current_peak_index - self.peak_previous_index)  # Erotus
+            self.current_peak = self.threshold
+            self.peak_previous_index = self.current_peak_index
+        return interval
+
+    def calculate_peaks(self, point):
+        # live heart rate only
+        interval = self.detect_peak(point)
+        if interval and self.bpm_window.add(interval):
+            self.bpm_output = self.bpm_window.bpm()
+
+    def analyze_peaks(self, point):
+        # live heart rate and the statistics for the analysis
+        interval = self.detect_peak(point)
+        if interval:
+            self.analyze_interval(interval)
+
+    def kernel_calculate_peaks(self, point):
+        interval = detector.detect(self.state, point)
+        if interval and self.bpm_window.add(interval):
+            self.bpm_output = self.bpm_window.bpm()
+
+    def kernel_analyze_peaks(self, point):
+        interval = detector.detect(self.state, point)
+        if interval:
+            self.analyze_interval(interval)
+
+    def analyze_interval(self, interval):
+        if self.bpm_window.add(interval):
+            self.bpm_output = self.bpm_window.bpm()
+        if self.stats.add(interval) and self.total_intervals is not None:
+            self.total_intervals.append(interval)
+
+    def analyze_variability(self):
+        results = self.stats.results()
+        if results is None:
+            return True
+
+        timestamp = time.localtime()
+
+        self.analysis_results = {
+            "id": time.time(),
+            "timestamp": f"{timestamp[2]}.{timestamp[1]}.{timestamp[0]} {timestamp[3]}.{timestamp[4]}"
+        }
+        self.analysis_results.update(results)
+        if self.total_intervals is not None:
+            # LF/HF and estimated SNS/PNS, once the series is long enough
+            frequency = hrv_freq.analyze(self.total_intervals, sample_interval)
+            if frequency is not None:
+                self.analysis_results.update(frequency)
+                self.analysis_results.update(hrv_freq.indices(self.analysis_results))
+        if self.verbose:
+            print(self.analysis_results)
@@ -0,0 +1,288 @@
+from array import array
+import math
+import sys
+import time
+
+# Frequency-domain HRV on the device, so the LF/HF balance and estimates of
+# the SNS and PNS indices do not need the Kubios round trip. The intervals
+# are resampled to an even 4 Hz grid, split into half-overlapping segments of
+# at most SIZE samples (Welch), Hann windowed and transformed by an integer
+# radix-2 FFT. Memory is bounded by SIZE whatever the length of the
+# recording. reference() does the same in floating point to validate the
+# integer path on a computer: python hrv_freq.py sample_data/*.txt
+
+RATE = 4 # Hz of the resampled tachogram
+SIZE = 256 # FFT points, 64 s at 4 Hz
+UNITS = 8 # resampled values are in 1/8 ms
+BITS = 14 # fixed-point fraction of the window and the twiddle factors
+MIN_SECONDS = 20 # shortest series that gets a spectrum
+LF_BAND = (0.04, 0.15) # Hz
+HF_BAND = (0.15, 0.4)
+
+# Rough stand-ins for the Kubios readiness indices: the average z-score of
+# a few parameters against assumed resting values of healthy adults (mean,
+# standard deviation). 0 is normal, positive above normal. Check against
+# Kubios replies for the same measurements before trusting the decimals.
+NORMS = {
+    "mean_ppi": (926, 90), # ms
+    "rmssd": (42, 15), # ms
+    "ln_hf": (6.0, 1.0), # ln ms^2
+    "mean_hr": (66, 6), # bpm
+    "ln_lf_hf": (0.4, 0.8)
+}
+
+# Only the window of the latest segment length is kept: every segment of an
+# analysis has the same length, but shorter series each have their own, and
+# a cache of all of them would grow for as long as the device runs
+window_cache = None # (length, Hann window in BITS fixed point, sum of squares)
+twiddle_tables = {} # n -> (cos, sin) in BITS fixed point, only n = SIZE is used
+
+def resample(intervals, unit=1, rate=RATE):
+    # Intervals (in units of `unit` ms) as an evenly spaced tachogram in
+    # 1/UNITS ms, interpolated linearly between the beats. Rejected beats
+    # are missing from the intervals, which shortens the time axis a little.
+    step = 1000 // rate
+    series = array('h')
+    beat = 0 # time of the current beat in ms
+    last_beat = last = None
+    grid = 0
+    for interval in intervals:
+        value = interval * unit * UNITS
+        beat += interval * unit
+        if last is None:
+            last_beat = grid = beat
+            last = value
+            continue
+        span = beat - last_beat
+        while grid <= beat:
+            # rounded (last + (value - last) * (grid - last_beat) / span)
+            series.append(last + ((value - last) * (grid - last_beat) * 2 + span) // (2 * span))
+            grid += step
+        last_beat = beat
+        last = value
+    return series
+
+def hann(length):
+    global window_cache
+    if window_cache is None or window_cache[0] != length:
+        window_cache = None ## drop the old window before allocating the new one
+        window = array('h', [0] * length)
+        squares = 0
+        for i in range(length):
+            w = 0.5 - 0.5 * math.cos(2 * math.pi * i / length)
+            window[i] = int(w * (1 << BITS) + 0.5)
+            squares += w * w
+        window_cache = (length, window, squares)
+    return window_cache[1], window_cache[2]
+
+def twiddles(n):
+    if n not in twiddle_tables:
+        cos = array('h', [0] * (n // 2))
+        sin = array('h', [0] * (n // 2))
+        for i in range(n // 2):
+            cos[i] = round(math.cos(2 * math.pi * i / n) * (1 << BITS))
+            sin[i] = round(math.sin(2 * math.pi * i / n) * (1 << BITS))
+        twiddle_tables[n] = (cos, sin)
+    return twiddle_tables[n]
+
+def fft(re, im, n):
+    # In-place radix-2 FFT of n points on integers with a block exponent:
+    # a stage halves all values first when one has reached 2**BITS, so the
+    # products stay in the small int range. Returns the exponent, the DFT
+    # is the result times 2**exponent.
+    cos, sin = twiddles(n)
+    exponent = 0
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            re[i], re[j] = re[j], re[i]
+            im[i], im[j] = im[j], im[i]
+    half = 1
+    while half < n:
+        if max(max(re), -min(re), max(im), -min(im)) >= (1 << BITS):
+            for i in range(n):
+                re[i] >>= 1
+                im[i] >>= 1
+            exponent += 1
+        step = n // (2 * half)
+        for k in range(half):
+            wr = cos[k * step]
+            wi = -sin[k * step]
+            for a in range(k, n, 2 * half):
+                b = a + half
+                tr = (wr * re[b] - wi * im[b]) >> BITS
+                ti = (wr * im[b] + wi * re[b]) >> BITS
+                re[b] = re[a] - tr
+                im[b] = im[a] - ti
+                re[a] += tr
+                im[a] += ti
+        half *= 2
+    return exponent
+
+def segments(n, size=SIZE):
+    # (start, length) of half-overlapping segments that end with the latest
+    # sample, a series shorter than size is one zero-padded segment
+    length = min(n, size)
+    hop = length // 2
+    return [(start, length) for start in range((n - length) % hop, n - length + 1, hop)]
+
+def band_bins(band, n, rate=RATE):
+    # FFT bins with band[0] <= f < band[1]
+    return range(math.ceil(band[0] * n / rate), math.ceil(band[1] * n / rate))
+
+def band_powers(series, rate=RATE, size=SIZE, bands=(LF_BAND, HF_BAND)):
+    # Power in ms^2 of every band, averaged over the Welch segments
+    re = array('i', [0] * size)
+    im = array('i', [0] * size)
+    powers = [0.0] * len(bands)
+    parts = segments(len(series), size)
+    for start, length in parts:
+        window, squares = hann(length)
+        total = 0
+        for i in range(start, start + length):
+            total += series[i]
+        mean = total // length
+        peak = 1
+        for i in range(start, start + length):
+            peak = max(peak, abs(series[i] - mean))
+        # shift that brings the largest sample just below 2**BITS
+        shift = 0
+        while peak >= (1 << BITS):
+            peak >>= 1
+            shift -= 1
+        while peak < (1 << (BITS - 1)):
+            peak <<= 1
+            shift += 1
+        for i in range(size):
+            if i < length:
+                x = series[start + i] - mean
+                x = x << shift if shift >= 0 else x >> -shift
+                re[i] = (x * window[i]) >> BITS
+            else:
+                re[i] = 0
+            im[i] = 0
+        exponent = fft(re, im, size)
+        # one-sided PSD 2|X|^2 / (rate * squares) times the bin width
+        # rate / size, with X = re * 2**(exponent - shift) in 1/UNITS ms
+        scale = 2 * 4 ** (exponent - shift) / (size * squares * UNITS * UNITS)
+        for b, band in enumerate(bands):
+            total = 0
+            for k in band_bins(band, size, rate):
+                total += re[k] * re[k] + im[k] * im[k]
+            powers[b] += total * scale
+    return [power / len(parts) for power in powers]
+
+def analyze(intervals, unit=1):
+    # LF and HF power (ms^2) and their ratio, None for a series shorter
+    # than MIN_SECONDS
+    series = resample(intervals, unit)
+    if len(series) < MIN_SECONDS * RATE:
+        return None
+    lf, hf = band_powers(series)
+    return {"lf": round(lf, 1), "hf": round(hf, 1), "lf_hf": round(lf / hf, 3) if hf else 0}
+
+def z(key, value):
+    mean, sd = NORMS[key]
+    return (value - mean) / sd
+
+def indices(results):
+    # Estimated SNS and PNS index from the time-domain results and the
+    # frequency bands: parasympathetic tone raises the intervals, RMSSD and
+    # HF power, sympathetic tone the heart rate and the LF/HF ratio. Kept
+    # apart from the Kubios sns/pns so they are never taken for the real ones.
+    ln_hf = math.log(max(results["hf"], 1))
+    ln_lf_hf = math.log(max(results["lf"], 1) / max(results["hf"], 1))
+    pns = (z("mean_ppi", results["mean_ppi"]) + z("rmssd", results["rmssd"]) + z("ln_hf", ln_hf)) / 3
+    sns = (z("mean_hr", results["mean_hr"]) + z("ln_lf_hf", ln_lf_hf)) / 2
+    return {"sns_est": round(sns, 3), "pns_est": round(pns, 3)}
+
+def reference(intervals, unit=1, rate=RATE, size=SIZE, bands=(LF_BAND, HF_BAND)):
+    # Floating-point version of analyze() for validation on a computer
+    import cmath
+    times = []
+    values = []
+    beat = 0
+    for interval in intervals:
+        beat += interval * unit
+        times.append(beat)
+        values.append(interval * unit)
+    series = []
+    grid = times[0] if times else 0
+    for i in range(1, len(times)):
+        while grid <= times[i]:
+            series.append(values[i - 1] + (values[i] - values[i - 1]) * (grid - times[i - 1]) / (times[i] - times[i - 1]))
+            grid += 1000 / rate
+    if len(series) < MIN_SECONDS * rate:
+        return None
+    powers = [0.0] * len(bands)
+    parts = segments(len(series), size)
+    for start, length in parts:
+        window = [0.5 - 0.5 * math.cos(2 * math.pi * i / length) for i in range(length)]
+        segment = series[start:start + length]
+        mean = sum(segment) / length
+        x = [(v - mean) * w for v, w in zip(segment, window)]
+        squares = sum(w * w for w in window)
+        for b, band in enumerate(bands):
+            for k in band_bins(band, size, rate):
+                X = sum(v * cmath.exp(-2j * math.pi * k * i / size) for i, v in enumerate(x))
+                powers[b] += 2 * abs(X) ** 2 / (size * squares)
+    lf, hf = (power / len(parts) for power in powers)
+    return {"lf": lf, "hf": hf, "lf_hf": lf / hf if hf else 0}
+
+def synthetic(seconds=120, lf=(0.1, 30), hf=(0.25, 20)):
+    # Intervals in ms of a heart whose rhythm is modulated by one LF and
+    # one HF sine (Hz, ms amplitude): the bands hold amplitude^2 / 2
+    intervals = []
+    t = 0
+    while t < seconds * 1000:
+        s = t / 1000
+        interval = round(900 + lf[1] * math.sin(2 * math.pi * lf[0] * s) + hf[1] * math.sin(2 * math.pi * hf[0] * s))
+        intervals.append(interval)
+        t += interval
+    return intervals
+
+def error(value, expected):
+    return abs(value - expected) / expected if expected else abs(value)
+
+def main(argv=None):
+    import argparse
+    from hrv_core import HRV, sample_interval
+    from replay import read_capture, replay
+    parser = argparse.ArgumentParser(description="Compare the fixed-point frequency analysis with a float reference")
+    parser.add_argument("captures", nargs="*", default=["sample_data/capture_250Hz_01.txt"])
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="replay every capture this many times (3 is about the 30 s of a device measurement)")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="largest relative error of LF and HF")
+    args = parser.parse_args(argv)
+
+    print(f"{'series':<32} {'beats':>5} {'LF ms2':>9} {'ref':>9} {'HF ms2':>9} {'ref':>9} {'LF/HF':>6} {'err':>6} {'ms':>6}")
+    # linear interpolation between beats damps the HF sine to about 140
+    cases = [("synthetic (LF 450, HF 200 ms2)", synthetic(), 1)]
+    for path in args.captures:
+        hrv = HRV(True)
+        hrv.verbose = False
+        replay(read_capture([path], args.repeat), hrv)
+        cases.append((path, list(hrv.total_intervals), sample_interval))
+    worst = 0
+    for name, intervals, unit in cases:
+        start = time.perf_counter()
+        fixed = analyze(intervals, unit)
+        ms = (time.perf_counter() - start) * 1000
+        exact = reference(intervals, unit)
+        if fixed is None or exact is None:
+            print(f"{name:<32} {len(intervals):>5} shorter than {MIN_SECONDS} s")
+            continue
+        lf, hf = band_powers(resample(intervals, unit)) ## analyze() rounds
+        err = max(error(lf, exact["lf"]), error(hf, exact["hf"]))
+        worst = max(worst, err)
+        print(f"{name:<32} {len(intervals):>5} {lf:>9.2f} {exact['lf']:>9.2f} {hf:>9.2f} "
+              f"{exact['hf']:>9.2f} {fixed['lf_hf']:>6.2f} {err * 100:>5.2f}% {ms:>6.1f}")
+    print(f"largest error {worst * 100:.2f}% (tolerance {args.tolerance * 100:.0f}%)")
+    return 1 if worst > args.tolerance else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import json
+import math
+import sqlite3
+import sys
+import time
+
+# Host-side receiver for the results the devices upload on "hr-data". A
+# message holds one result object or a list of them (ResultLog.flush() sends
+# up to 10 at once). Every result is checked against the analysis_results
+# schema and buffered; the buffer goes to SQLite in one transaction when it
+# holds batch rows or its oldest row has waited max_delay ms, so the disk
+# sees one commit per batch instead of one per message. Rows are keyed on
+# device and id, a batch that a device sends again after a dropped connection
+# is stored once.
+#
+# Running it as a service needs paho-mqtt (pip install paho-mqtt), see
+# loadgen.py for a load test without a broker.
+
+REQUIRED = ("mean_ppi", "mean_hr", "sdnn", "rmssd")
+OPTIONAL = ("sns", "pns", "sns_est", "pns_est") # Kubios indices, on-device estimates
+COLUMNS = ("device", "id", "timestamp") + REQUIRED + OPTIONAL + ("received",)
+
+class SchemaError(ValueError):
+    pass
+
+def number(result, key, required=True):
+    value = result.get(key)
+    if value is None:
+        if required:
+            raise SchemaError(f"{key} missing")
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise SchemaError(f"{key} is not a number: {value!r}")
+    return float(value)
+
+def validate(result):
+    # One analysis_results object as a row without the receive time
+    if not isinstance(result, dict):
+        raise SchemaError(f"result is not an object: {result!r}")
+    id = result.get("id")
+    if isinstance(id, bool) or not isinstance(id, int) or id < 0:
+        raise SchemaError(f"id is not a positive integer: {id!r}")
+    timestamp = result.get("timestamp")
+    if not isinstance(timestamp, str):
+        raise SchemaError(f"timestamp is not a string: {timestamp!r}")
+    device = result.get("device", "") # older firmware does not send it
+    if not isinstance(device, str):
+        raise SchemaError(f"device is not a string: {device!r}")
+    values = [number(result, key) for key in REQUIRED]
+    values += [number(result, key, False) for key in OPTIONAL]
+    return (device, id, timestamp, *values)
+
+class Store:
+    def __init__(self, path="results.db", batch=500, max_delay=1000):
+        self.batch = batch # rows per transaction
+        self.max_delay = max_delay # ms a row may wait for its transaction
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL") ## a commit survives a crash of the service, not of the OS
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results (device TEXT NOT NULL, id INTEGER NOT NULL, timestamp TEXT,"
+            " mean_ppi REAL, mean_hr REAL, sdnn REAL, rmssd REAL, sns REAL, pns REAL, received REAL,"
+            " sns_est REAL, pns_est REAL, PRIMARY KEY (device, id)) WITHOUT ROWID")
+        # databases from before the estimates were stored apart
+        existing = {row[1] for row in self.db.execute("PRAGMA table_info(results)")}
+        for column in COLUMNS:
+            if column not in existing:
+                self.db.execute(f"ALTER TABLE results ADD COLUMN {column} REAL")
+        self.insert = f"INSERT OR IGNORE INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        self.pending = []
+        self.oldest = 0 # time.monotonic() of the first pending row
+        self.on_commit = None # callback(rows) once rows are stored
+        self.stored = 0
+        self.duplicates = 0
+        self.commits = 0
+
+    def add(self, rows):
+        if not self.pending:
+            self.oldest = time.monotonic()
+        self.pending.extend(rows)
+        if len(self.pending) >= self.batch:
+            self.commit()
+
+    def tick(self):
+        # Commits rows that have waited long enough, call this regularly
+        if self.pending and (time.monotonic() - self.oldest) * 1000 >= self.max_delay:
+            self.commit()
+
+    def commit(self):
+        rows = self.pending
+        if not rows:
+            return
+        self.pending = []
+        before = self.db.total_changes
+        with self.db:
+            self.db.executemany(self.insert, rows)
+        inserted = self.db.total_changes - before
+        self.stored += inserted
+        self.duplicates += len(rows) - inserted
+        self.commits += 1
+        if self.on_commit is not None:
+            self.on_commit(rows)
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+class Ingestor:
+    def __init__(self, store):
+        self.store = store
+        self.messages = 0
+        self.results = 0 # accepted results, duplicates included
+        self.rejected = 0 # results that failed the schema
+        self.malformed = 0 # messages that are not JSON
+        self.last_error = None
+
+    def handle(self, topic, msg):
+        # callback(topic, msg) for an MQTT subscription to "hr-data"
+        self.messages += 1
+        try:
+            payload = json.loads(msg)
+        except ValueError as e:
+            self.malformed += 1
+            self.last_error = f"not JSON: {e}"
+            return
+        received = time.time()
+        rows = []
+        for result in payload if isinstance(payload, list) else (payload,):
+            try:
+                rows.append(validate(result) + (received,))
+            except SchemaError as e:
+                self.rejected += 1
+                self.last_error = str(e)
+        if rows:
+            self.results += len(rows)
+            self.store.add(rows)
+        self.store.tick()
+
+    def tick(self):
+        self.store.tick()
+
+    def close(self):
+        self.store.close()
+
+    def status(self):
+        store = self.store
+        return (f"{self.messages} messages, {store.stored} results stored, {store.duplicates} duplicates, "
+                f"{self.rejected} rejected, {self.malformed} malformed, {store.commits} commits")
+
+def mqtt_client(client_id):
+    try:
+        import paho.mqtt.client as paho
+    except ImportError:
+        raise SystemExit("Receiving from a broker needs paho-mqtt: pip install paho-mqtt")
+    try:
+        return paho.Client(paho.CallbackAPIVersion.VERSION2, client_id)
+    except AttributeError: ## paho-mqtt 1.x
+        return paho.Client(client_id)
+
+def serve(receiver, host, port, topic="hr-data", client_id="hrv-ingest", status_interval=10):
+    # Feeds the messages of topic to receiver.handle(topic, msg) until
+    # interrupted, calls receiver.tick() in between and receiver.close() at
+    # the end
+    client = mqtt_client(client_id)
+    # the callback signatures differ between paho-mqtt 1.x and 2.x
+    client.on_connect = lambda client, *args: client.subscribe(topic, qos=1)
+    client.on_message = lambda client, userdata, message: receiver.handle(message.topic, message.payload)
+    client.connect(host, port)
+    next_status = time.monotonic() + status_interval
+    try:
+        while True:
+            if client.loop(0.1) != 0:
+                print("Connection lost", file=sys.stderr)
+                time.sleep(1)
+                try:
+                    client.reconnect()
+                except OSError as e:
+                    print(f"Failed to reconnect: {e}", file=sys.stderr)
+            receiver.tick()
+            if time.monotonic() >= next_status:
+                print(receiver.status(), file=sys.stderr)
+                next_status += status_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+        client.disconnect()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Store the HRV results devices publish on hr-data in SQLite")
+    parser.add_argument("--host", default="localhost", help="MQTT broker")
+    parser.add_argument("--port", type=int, default=21883)
+    parser.add_argument("--topic", default="hr-data")
+    parser.add_argument("--db", default="results.db", help="SQLite database, created if missing")
+    parser.add_argument("--batch", type=int, default=500, help="rows per transaction")
+    parser.add_argument("--max-delay", type=int, default=1000, help="ms a result may wait for its transaction")
+    args = parser.parse_args(argv)
+
+    ingestor = Ingestor(Store(args.db, args.batch, args.max_delay))
+    print(f"Storing {args.topic} from {args.host}:{args.port} in {args.db}", file=sys.stderr)
+    serve(ingestor, args.host, args.port, args.topic)
+    print(ingestor.status(), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sim.broker import Broker
+from sim.clock import Clock, EPOCH
+from ingest import Ingestor, Store
+
+# Load test for ingest.py: thousands of simulated devices publish results on
+# "hr-data" through the in-memory broker of the simulation (sim/broker.py),
+# which hands every message to the ingestor like the MQTT client of the
+# service would. Messages look like ResultLog.flush() output: mostly single
+# results, sometimes a batch of a device catching up after being offline.
+# Reports the sustained message rate and the latency from publishing a
+# result until its transaction is committed.
+
+class Device:
+    def __init__(self, rng, n):
+        self.rng = rng
+        self.client_id = f"hrv-{rng.getrandbits(64):016x}"
+        self.next_id = EPOCH + n # analysis ids are time.time() on the device
+
+    def result(self):
+        rng = self.rng
+        self.next_id += rng.randint(60, 3600)
+        t = time.gmtime(self.next_id)
+        mean_ppi = rng.uniform(600, 1100)
+        rmssd = rng.uniform(15, 80)
+        result = {
+            "id": self.next_id,
+            "timestamp": f"{t[2]}.{t[1]}.{t[0]} {t[3]}.{t[4]}",
+            "mean_ppi": int(mean_ppi),
+            "mean_hr": int(60000 / mean_ppi),
+            "sdnn": int(rmssd * rng.uniform(0.8, 1.5)),
+            "rmssd": int(rmssd),
+            "device": self.client_id
+        }
+        # Kubios results have the indices, local ones the estimates
+        kind = ("sns", "pns") if rng.random() < 0.3 else ("sns_est", "pns_est")
+        result[kind[0]] = round(rng.uniform(-2, 3), 3)
+        result[kind[1]] = round(rng.uniform(-2, 3), 3)
+        return result
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(devices=2000, messages=100000, rate=0, db=":memory:", batch=500, max_delay=1000,
+        catch_up=0.05, duplicates=0.01, invalid=0.001, seed=1):
+    # rate 0 publishes as fast as the ingestor takes the messages
+    rng = random.Random(seed)
+    fleet = [Device(rng, n) for n in range(devices)]
+    broker = Broker(Clock())
+    broker.keep_log = False
+    store = Store(db, batch, max_delay)
+    ingestor = Ingestor(store)
+    broker.subscribe("hr-data", ingestor.handle)
+
+    sent = {} # (device, id) -> perf_counter() at publish
+    latencies = []
+    def committed(rows):
+        now = time.perf_counter()
+        for row in rows:
+            start = sent.pop(row[:2], None)
+            if start is not None:
+                latencies.append(now - start)
+    store.on_commit = committed
+
+    last = None # last message, sent again for the duplicates
+    ingest_s = 0
+    start = time.perf_counter()
+    for i in range(messages):
+        if rate:
+            wait = start + i / rate - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        roll = rng.random()
+        if roll < invalid:
+            msg = json.dumps({"id": "x", "timestamp": 0})
+        elif roll < invalid + duplicates and last is not None:
+            msg = last
+        else:
+            device = fleet[i % devices]
+            count = rng.randint(2, 10) if rng.random() < catch_up else 1
+            results = [device.result() for _ in range(count)]
+            now = time.perf_counter()
+            for result in results:
+                sent[(result["device"], result["id"])] = now
+            msg = last = json.dumps(results[0] if count == 1 else results)
+        before = time.perf_counter()
+        broker.publish("hr-data", msg)
+        ingest_s += time.perf_counter() - before
+    store.close()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "devices": devices,
+        "messages": ingestor.messages,
+        "results": ingestor.results,
+        "stored": store.stored,
+        "duplicates": store.duplicates,
+        "rejected": ingestor.rejected + ingestor.malformed,
+        "commits": store.commits,
+        "elapsed": elapsed,
+        "rate": ingestor.messages / elapsed,
+        "results_rate": ingestor.results / elapsed,
+        "ingest_us": ingest_s / ingestor.messages * 1e6 if ingestor.messages else 0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": latencies[-1] * 1000 if latencies else 0
+        }
+    }
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Load test ingest.py with simulated devices")
+    parser.add_argument("-d", "--devices", type=int, default=2000)
+    parser.add_argument("-n", "--messages", type=int, default=100000)
+    parser.add_argument("-r", "--rate", type=float, default=0, help="messages per second, 0 for as fast as possible")
+    parser.add_argument("--db", help="SQLite database (default: a new temporary file)")
+    parser.add_argument("--batch", type=int, default=500, help="rows per transaction")
+    parser.add_argument("--max-delay", type=int, default=1000, help="ms a result may wait for its transaction")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    db = args.db
+    if db is None:
+        handle, db = tempfile.mkstemp(prefix="hrv-ingest-", suffix=".db")
+        os.close(handle)
+    try:
+        report = run(args.devices, args.messages, args.rate, db, args.batch, args.max_delay, seed=args.seed)
+    finally:
+        if args.db is None:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db + suffix):
+                    os.remove(db + suffix)
+    latency = report["latency_ms"]
+    print(f"{report['devices']} devices, {report['messages']} messages with {report['results']} results "
+          f"in {report['elapsed']:.2f} s")
+    print(f"sustained    {report['rate']:.0f} messages/s, {report['results_rate']:.0f} results/s, "
+          f"{report['ingest_us']:.0f} us per message in the ingestor")
+    print(f"stored       {report['stored']} in {report['commits']} transactions, "
+          f"{report['duplicates']} duplicates, {report['rejected']} rejected")
+    print(f"latency      p50 {latency['p50']:.1f} ms, p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms "
+          f"from publish to commit")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+from umqtt.simple import MQTTClient, MQTTException
+import time
+import uasyncio as asyncio
+
+# One long-lived MQTT connection shared by everything that publishes or
+# subscribes. It connects on first use, keeps the connection alive with pings
+# from poll() and, when the broker cannot be reached, waits with an
+# exponential backoff before the next attempt instead of reconnecting on
+# every publish. A refused CONNACK or a failed SUBACK raises MQTTException
+# rather than OSError, both count as a broken connection.
+#
+# The socket connect of umqtt blocks, so only the MQTT task opens the
+# connection, through open(): it first reaches the broker with a non-blocking
+# TCP connect that the other tasks keep running through, and starts the MQTT
+# handshake only once the broker has answered, with connect_timeout as the
+# socket timeout. publish() and poll() never connect by themselves.
+
+class MqttSession:
+    def __init__(self, client_id, server, port=1883, keepalive=60, min_backoff=1000, max_backoff=60000, connect_timeout=3000):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive # s, broker drops the connection after 1.5x this without traffic
+        self.min_backoff = min_backoff # ms
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.connect_timeout = connect_timeout # ms
+        self.client = None
+        self.handlers = {} # topic -> callback(topic, msg)
+        self.next_attempt = time.ticks_ms()
+        self.last_activity = self.next_attempt
+        self.connects = 0
+        self.failures = 0
+
+    def connected(self):
+        return self.client is not None
+
+    def due(self):
+        # the backoff after the last failed attempt has passed
+        return time.ticks_diff(time.ticks_ms(), self.next_attempt) >= 0
+
+    def failed(self, e):
+        print(f"Failed to connect to MQTT: {e}")
+        self.failures += 1
+        self.next_attempt = time.ticks_add(time.ticks_ms(), self.backoff)
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    async def open(self):
+        # connect() for the MQTT task, see above. Returns True when connected.
+        if self.client is not None:
+            return True
+        if not self.due():
+            return False
+        try:
+            reader, writer = await asyncio.wait_for_ms(asyncio.open_connection(self.server, self.port), self.connect_timeout)
+            writer.close()
+            await writer.wait_closed()
+        except asyncio.TimeoutError:
+            self.failed("broker did not answer")
+            return False
+        except OSError as e:
+            self.failed(e)
+            return False
+        return self.connect()
+
+    def connect(self):
+        # Returns True when connected. Failed attempts are not retried until
+        # the backoff has passed, so calling this often is cheap. Blocks for
+        # up to connect_timeout when the broker does not answer.
+        if self.client is not None:
+            return True
+        if not self.due():
+            return False
+        client = MQTTClient(self.client_id, self.server, port=self.port, keepalive=self.keepalive)
+        client.set_callback(self.dispatch)
+        try:
+            client.connect(clean_session=True, timeout=self.connect_timeout / 1000)
+            for topic in self.handlers:
+                client.subscribe(topic)
+        except (OSError, MQTTException) as e:
+            self.close(client)
+            self.failed(e)
+            return False
+        self.client = client
+        self.connects += 1
+        self.backoff = self.min_backoff
+        self.last_activity = time.ticks_ms()
+        return True
+
+    def close(self, client):
+        try:
+            client.sock.close()
+        except Exception:
+            pass
+
+    def drop(self):
+        # connection broke, reconnect on next use
+        if self.client is not None:
+            self.close(self.client)
+            self.client = None
+        self.next_attempt = time.ticks_ms()
+
+    def disconnect(self):
+        if self.client is not None:
+            try:
+                self.client.disconnect()
+            except (OSError, MQTTException):
+                pass
+            self.drop()
+
+    def subscribe(self, topic, handler):
+        # handler replaces any earlier handler of the topic
+        new = topic not in self.handlers
+        self.handlers[topic] = handler
+        if new and self.client is not None:
+            try:
+                self.client.subscribe(topic)
+            except (OSError, MQTTException):
+                self.drop()
+
+    def dispatch(self, topic, msg):
+        handler = self.handlers.get(topic.decode())
+        if handler is not None:
+            handler(topic, msg)
+
+    def publish(self, topic, msg):
+        # False when not connected, the MQTT task connects
+        if self.client is None:
+            return False
+        try:
+            self.client.publish(topic, msg)
+        except (OSError, MQTTException) as e:
+            print(f"Failed to send MQTT message: {e}")
+            self.drop()
+            return False
+        self.last_activity = time.ticks_ms()
+        return True
+
+    def poll(self):
+        # Handles incoming messages and keeps an idle connection alive.
+        # Never connects by itself, so it is safe to call from the UI loop.
+        if self.client is None:
+            return
+        try:
+            self.client.check_msg()
+            now = time.ticks_ms()
+            if time.ticks_diff(now, self.last_activity) > self.keepalive * 500:
+                self.client.ping()
+                self.last_activity = now
+        except (OSError, MQTTException):
+            self.drop()
@@ -0,0 +1,184 @@
+import os
+import struct
+import sys
+import time
+from array import array
+
+from capture import HEADER as CAPTURE_HEADER, MAGIC, BINARY_EXTENSION
+from ppg_stream import HEADER, HEADER_SIZE
+
+# Host-side receiver of the raw PPG stream (ppg_stream.py). Frames are put
+# back together per device, in sample tick order, into one capture per
+# measurement in the format of sample_data/ (or the binary format of
+# capture.py). A measurement ends when the device starts again from
+# sequence number 0 or sends nothing for idle_timeout seconds.
+#
+# Frames lost on the way and samples the sensor FIFO dropped show up as jumps
+# in the sample tick. The gap is filled with the last sample, so the capture
+# keeps its 250 Hz time base, and reported with the capture. Frames that
+# arrive again or too late are skipped.
+
+class Recording:
+    def __init__(self, path, binary, rate):
+        self.path = path
+        self.binary = binary
+        self.f = open(path, "wb")
+        if binary:
+            self.f.write(CAPTURE_HEADER.pack(MAGIC, rate, 0))
+        self.next_tick = None # sample tick of the next sample
+        self.first_tick = None # of the first sample received
+        self.next_seq = 0
+        self.last = 0 # last sample, fills gaps
+        self.samples = 0 # written, gaps included
+        self.frames = 0
+        self.lost_frames = 0
+        self.late_frames = 0
+        self.gaps = [] # (sample tick, missing samples)
+        self.updated = time.monotonic()
+
+    def add(self, seq, tick, samples):
+        self.updated = time.monotonic()
+        if self.next_tick is None:
+            # the start is missing when the device was offline or the
+            # receiver joined in the middle of a measurement
+            self.first_tick = tick
+            self.next_tick = tick
+            self.next_seq = seq
+        if tick < self.next_tick:
+            self.late_frames += 1
+            return
+        if seq > self.next_seq:
+            self.lost_frames += seq - self.next_seq
+        if tick > self.next_tick:
+            missing = tick - self.next_tick
+            self.gaps.append((self.next_tick, missing))
+            self.write(array("H", [self.last]) * missing)
+        self.write(samples)
+        self.frames += 1
+        self.next_seq = seq + 1
+        self.next_tick = tick + len(samples)
+        if samples:
+            self.last = samples[-1]
+
+    def write(self, samples):
+        if self.binary:
+            if sys.byteorder == "big":
+                samples = array("H", samples)
+                samples.byteswap()
+            samples.tofile(self.f)
+        else:
+            self.f.write(b"".join(b"%d\n" % sample for sample in samples))
+        self.samples += len(samples)
+
+    def close(self):
+        self.f.close()
+
+    def summary(self):
+        missing = sum(n for tick, n in self.gaps)
+        summary = (f"{self.path}: {self.samples} samples, {self.frames} frames, {len(self.gaps)} gaps "
+                   f"({missing} samples filled, {self.lost_frames} frames lost), {self.late_frames} late frames")
+        if self.first_tick:
+            summary += f", starts at sample {self.first_tick} of the measurement"
+        return summary
+
+def parse(msg):
+    # A message as a list of (seq, tick, samples), raises ValueError when
+    # a frame is cut short
+    frames = []
+    offset = 0
+    while offset < len(msg):
+        if len(msg) - offset < HEADER_SIZE:
+            raise ValueError(f"truncated frame header at byte {offset}")
+        seq, tick, count = struct.unpack_from(HEADER, msg, offset)
+        offset += HEADER_SIZE
+        end = offset + count * 2
+        if end > len(msg):
+            raise ValueError(f"frame {seq} has {count} samples, message ends after {(len(msg) - offset) // 2}")
+        samples = array("H")
+        samples.frombytes(msg[offset:end])
+        if sys.byteorder == "big":
+            samples.byteswap()
+        frames.append((seq, tick, samples))
+        offset = end
+    return frames
+
+class Receiver:
+    def __init__(self, directory=".", binary=False, rate=250, idle_timeout=10):
+        self.directory = directory
+        self.binary = binary
+        self.rate = rate # Hz, stored in binary captures
+        self.idle_timeout = idle_timeout # s
+        self.recordings = {} # device -> open Recording
+        self.finished = [] # summaries of closed recordings
+        self.messages = 0
+        self.malformed = 0
+
+    def handle(self, topic, msg):
+        # callback(topic, msg) for an MQTT subscription to "hr-ppg/#"
+        self.messages += 1
+        device = topic.split("/", 1)[1] if "/" in topic else topic
+        try:
+            frames = parse(msg)
+        except (ValueError, struct.error) as e:
+            self.malformed += 1
+            print(f"{device}: {e}", file=sys.stderr)
+            return
+        for seq, tick, samples in frames:
+            recording = self.recordings.get(device)
+            if recording is not None and seq == 0 and recording.frames:
+                self.finish(device)
+                recording = None
+            if recording is None:
+                recording = self.recordings[device] = Recording(self.new_path(device), self.binary, self.rate)
+            recording.add(seq, tick, samples)
+
+    def new_path(self, device):
+        os.makedirs(self.directory, exist_ok=True)
+        stem = os.path.join(self.directory, f"{device}-{time.strftime('%Y%m%d-%H%M%S')}")
+        extension = BINARY_EXTENSION if self.binary else ".txt"
+        path = stem + extension
+        n = 1
+        while os.path.exists(path):
+            path = f"{stem}-{n}{extension}"
+            n += 1
+        return path
+
+    def finish(self, device):
+        recording = self.recordings.pop(device)
+        recording.close()
+        self.finished.append(recording.summary())
+        print(self.finished[-1], file=sys.stderr)
+
+    def tick(self):
+        now = time.monotonic()
+        for device in list(self.recordings):
+            if now - self.recordings[device].updated > self.idle_timeout:
+                self.finish(device)
+
+    def close(self):
+        for device in list(self.recordings):
+            self.finish(device)
+
+    def status(self):
+        return f"{self.messages} messages, {len(self.recordings)} recording, {len(self.finished)} captures written, {self.malformed} malformed"
+
+def main(argv=None):
+    import argparse
+    from ingest import serve
+    parser = argparse.ArgumentParser(description="Write the raw PPG streams of devices to capture files")
+    parser.add_argument("--host", default="localhost", help="MQTT broker")
+    parser.add_argument("--port", type=int, default=21883)
+    parser.add_argument("--topic", default="hr-ppg/#")
+    parser.add_argument("-o", "--output", default=".", help="directory for the captures")
+    parser.add_argument("--binary", action="store_true", help=f"write binary {BINARY_EXTENSION} captures instead of text")
+    parser.add_argument("--idle-timeout", type=float, default=10, help="s without frames that end a capture")
+    args = parser.parse_args(argv)
+
+    receiver = Receiver(args.output, args.binary, idle_timeout=args.idle_timeout)
+    print(f"Writing {args.topic} from {args.host}:{args.port} to {args.output}", file=sys.stderr)
+    serve(receiver, args.host, args.port, args.topic, "hrv-ppg-receive")
+    print(receiver.status(), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+from array import array
+import struct
+
+# Raw PPG streaming for review on a computer (PPG_STREAM = const(1) in
+# hrv.py). The samples the UI drains from the sensor FIFO are collected into
+# fixed-size frames and a few frames make one MQTT message. Per sample this
+# costs one array store; packing happens once per message and publishing in
+# the MQTT task, so the 250 Hz sampling is not disturbed. While the broker is
+# not connected at most `queue` messages wait, older ones are dropped and the
+# receiver (ppg_receive.py) sees the gap in the sample ticks.
+#
+# Frame: HEADER (sequence number, sample tick of the first sample, sample
+# count) followed by count little-endian uint16 samples. Sample ticks count
+# sample periods since start(), samples the sensor FIFO dropped included, so
+# an overflow shows up as a gap before the next frame. A message holds one or
+# more frames back to back. Every frame has frame_samples samples except the
+# last of a measurement, sequence numbers start from 0 for every measurement.
+
+HEADER = "<IIH"
+HEADER_SIZE = 10
+FRAME_SAMPLES = 125 # 0.5 s at 250 Hz
+BATCH = 4 # frames per message
+
+class PpgStream:
+    def __init__(self, frame_samples=FRAME_SAMPLES, batch=BATCH, queue=2):
+        self.frame_samples = frame_samples
+        self.batch = batch
+        self.limit = queue # packed messages waiting for the MQTT task
+        self.samples = array('H', [0] * (frame_samples * batch))
+        self.ticks = array('I', [0] * batch) # sample tick of every frame in the buffer
+        self.n = 0 # samples in the buffer
+        self.frame_end = frame_samples # n at the end of the current frame
+        self.added = 0 # samples since start()
+        self.seq = 0 # sequence number of the first frame in the buffer
+        self.queue = [] # (message, frames)
+        self.fifo = None
+        self.base = 0 # drops of the FIFO before start()
+        self.running = False
+        self.sent = 0 # frames published
+        self.lost = 0 # frames dropped before publishing
+
+    def start(self, fifo):
+        # fifo is the sensor FIFO, watched for dropped samples
+        self.fifo = fifo
+        self.base = fifo.dc
+        self.n = 0
+        self.frame_end = self.frame_samples
+        self.added = 0
+        self.seq = 0
+        self.ticks[0] = 0
+        self.running = True
+
+    def add(self, point):
+        n = self.n
+        self.samples[n] = point
+        n += 1
+        self.n = n
+        if n == self.frame_end:
+            self.next_frame()
+
+    def next_frame(self):
+        self.added += self.frame_samples
+        if self.n == len(self.samples):
+            self.pack()
+            self.n = 0
+        self.frame_end = self.n + self.frame_samples
+        self.ticks[self.n // self.frame_samples] = self.added + self.fifo.dc - self.base
+
+    def pack(self):
+        # the buffered samples as one message
+        message = bytearray()
+        view = memoryview(self.samples)
+        frames = 0
+        for i in range(0, self.n, self.frame_samples):
+            count = min(self.frame_samples, self.n - i)
+            message += struct.pack(HEADER, self.seq + frames, self.ticks[frames], count)
+            message += view[i:i + count] ## the RP2040 is little-endian
+            frames += 1
+        self.seq += frames
+        if len(self.queue) >= self.limit:
+            self.lost += self.queue.pop(0)[1]
+        self.queue.append((message, frames))
+
+    def stop(self):
+        # end of the measurement, the last frame may be short
+        if not self.running:
+            return
+        self.running = False
+        if self.n:
+            self.pack()
+            self.n = 0
+
+    def publish(self, session, topic):
+        # Called from the MQTT task. Sends the queued messages while the
+        # session is connected, never connects by itself.
+        while self.queue and session.connected():
+            message, frames = self.queue.pop(0)
+            if session.publish(topic, message):
+                self.sent += frames
+            else:
+                self.lost += frames
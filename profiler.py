@@ -0,0 +1,142 @@
+from array import array
+import time
+
+# Per-stage timing of the UI loop for profiling builds (PROFILE = const(1) in
+# hrv.py). Each stage keeps count, total, min and max and a histogram in a
+# preallocated array, so recording a time allocates nothing. Histogram
+# buckets are exact below 4 us and above that split every power of two in 4,
+# which gives the p99 to within 25%. FIFOs are watched for their high-water
+# mark and dropped values.
+
+STAGES = ("loop", "drain", "thres", "peaks", "draw", "show")
+LOOP = 0 # whole UI.display()
+DRAIN = 1 # emptying the sensor FIFO
+THRESHOLD = 2 # calculate_threshold, per sample
+PEAKS = 3 # peak detection and analysis, per sample
+DRAW = 4 # measurement_render
+SHOW = 5 # oled.show()
+BUCKETS = 4 + 4 * 22 # up to about 8 s
+
+def bucket(us):
+    if us < 4:
+        return us
+    shift = 0
+    while us >= 8:
+        us >>= 1
+        shift += 1
+    b = 4 + 4 * shift + us - 4
+    return b if b < BUCKETS else BUCKETS - 1
+
+def bucket_limit(b):
+    # largest time that falls into bucket b
+    if b < 4:
+        return b
+    shift = (b - 4) // 4
+    return ((5 + (b - 4) % 4) << shift) - 1
+
+class Profiler:
+    def __init__(self, names=STAGES, fifos=("sensor", "encoder")):
+        self.names = names
+        n = len(names)
+        self.histogram = [array('I', [0] * BUCKETS) for _ in range(n)]
+        self.count = array('I', [0] * n)
+        self.min = array('I', [0] * n)
+        self.max = array('I', [0] * n)
+        self.total = [0] * n
+        self.fifo_names = fifos
+        self.fifo_high = array('H', [0] * len(fifos))
+        self.fifo_dropped = array('I', [0] * len(fifos))
+        self.fifo_seen = [None] * len(fifos) # Fifo object watched last
+        self.fifo_base = array('I', [0] * len(fifos)) # dropped by the earlier ones
+        self.started = time.ticks_ms()
+
+    def reset(self):
+        for i in range(len(self.names)):
+            histogram = self.histogram[i]
+            for b in range(BUCKETS):
+                histogram[b] = 0
+            self.count[i] = 0
+            self.min[i] = 0
+            self.max[i] = 0
+            self.total[i] = 0
+        for i in range(len(self.fifo_names)):
+            self.fifo_high[i] = 0
+            self.fifo_dropped[i] = 0
+            self.fifo_seen[i] = None
+        self.started = time.ticks_ms()
+
+    def add(self, stage, us):
+        if us < 0:
+            us = 0
+        if self.count[stage] == 0 or us < self.min[stage]:
+            self.min[stage] = us
+        if us > self.max[stage]:
+            self.max[stage] = us
+        self.count[stage] += 1
+        self.total[stage] += us
+        self.histogram[stage][bucket(us)] += 1
+
+    def fifo(self, i, fifo):
+        # Call before draining. Fifo objects may be replaced (Sensor does on
+        # every stop), the dropped values of the earlier ones are kept.
+        depth = (fifo.head - fifo.tail) % fifo.size
+        if depth > self.fifo_high[i]:
+            self.fifo_high[i] = depth
+        if fifo is not self.fifo_seen[i]:
+            if self.fifo_seen[i] is not None:
+                self.fifo_base[i] = self.fifo_dropped[i]
+            self.fifo_seen[i] = fifo
+        self.fifo_dropped[i] = self.fifo_base[i] + fifo.dc
+
+    def percentile(self, stage, fraction):
+        n = self.count[stage]
+        if not n:
+            return 0
+        goal = n * fraction
+        seen = 0
+        histogram = self.histogram[stage]
+        for b in range(BUCKETS):
+            seen += histogram[b]
+            if seen >= goal:
+                return min(bucket_limit(b), self.max[stage])
+        return self.max[stage]
+
+    def mean(self, stage):
+        n = self.count[stage]
+        return self.total[stage] // n if n else 0
+
+    def results(self):
+        results = {"ms": time.ticks_diff(time.ticks_ms(), self.started)}
+        for i, name in enumerate(self.names):
+            results[name] = {
+                "n": self.count[i],
+                "min": self.min[i],
+                "mean": self.mean(i),
+                "max": self.max[i],
+                "p99": self.percentile(i, 0.99)
+            }
+        for i, name in enumerate(self.fifo_names):
+            results[name + "_fifo"] = {"high": self.fifo_high[i], "dropped": self.fifo_dropped[i]}
+        return results
+
+    def lines(self):
+        # Stage rows for the 16 character debug screen, times in us
+        # (k for ms)
+        rows = ["     avg p99 max"]
+        for i, name in enumerate(self.names):
+            rows.append(f"{name[:4]:4}{short(self.mean(i)):>4}{short(self.percentile(i, 0.99)):>4}{short(self.max[i]):>4}")
+        return rows
+
+    def fifo_lines(self):
+        rows = []
+        for i, name in enumerate(self.fifo_names):
+            rows.append(f"{name[:6]:6} {self.fifo_high[i]:>3} {self.fifo_dropped[i]:>4}")
+        return rows
+
+def short(us):
+    # at most 3 characters
+    if us < 1000:
+        return str(us)
+    if us < 100000:
+        return f"{us // 1000}k"
+    return "++"
@@ -0,0 +1,108 @@
+import sys
+import time
+
+from hrv_core import HRV, sample_interval
+import filters
+
+# Host-side replay of recorded captures through the same detector the Pico
+# runs. Capture files hold one ADC value per line sampled at 250 Hz.
+
+def read_capture(paths, repeat=1):
+    # Files (text or binary captures) are concatenated in order and read in
+    # chunks through capture.py, "-" reads a text capture from stdin
+    from capture import iter_samples
+    for _ in range(repeat):
+        for path in paths:
+            if path == "-":
+                for line in sys.stdin:
+                    line = line.strip()
+                    if line:
+                        yield int(line)
+            else:
+                yield from iter_samples(path)
+
+def prime(hrv, samples):
+    # Mirrors UI.sensor_setup: the first sample seeds min/max and samples go
+    # to the threshold only until one exists. Returns the samples consumed.
+    count = 0
+    for point in samples:
+        hrv.start(point)
+        count = 1
+        break
+    for point in samples:
+        count += 1
+        hrv.calculate_threshold(point)
+        if hrv.threshold is not None:
+            break
+    return count
+
+def replay(samples, hrv=None):
+    # prime() followed by UI.analysis_screen: every sample goes through
+    # threshold and peak detection
+    if hrv is None:
+        hrv = HRV()
+    samples = iter(samples)
+    count = prime(hrv, samples)
+    for point in samples:
+        count += 1
+        hrv.calculate_threshold(point)
+        hrv.analyze_peaks(point)
+    return hrv, count
+
+def compare(paths, spec=""):
+    # detected beats and usable intervals per capture for both thresholds,
+    # and for the sliding one behind the filters of spec if given
+    runs = [(True, ""), (False, "")]
+    header = f"{'capture':<32} {'block':>11} {'sliding':>11}"
+    if spec:
+        runs.append((False, spec))
+        header += f" {spec:>11}"
+    print(header)
+    for path in paths:
+        counts = []
+        for block, run_spec in runs:
+            hrv = HRV(block_threshold=block)
+            hrv.verbose = False
+            replay(filters.apply(filters.make(run_spec), read_capture([path])), hrv)
+            counts.append(f"{hrv.stats.count + hrv.stats.rejected}/{hrv.stats.count}")
+        print(f"{path:<32} " + " ".join(f"{count:>11}" for count in counts))
+    print("beats detected/usable intervals")
+    return 0
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay PPG captures through the HRV detector")
+    parser.add_argument("captures", nargs="+", help="capture files, - for stdin")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="replay the concatenated captures this many times")
+    parser.add_argument("-v", "--verbose", action="store_true", help="keep the detector's own debug prints")
+    parser.add_argument("--block-threshold", action="store_true", help="recalculate the threshold once per window instead of on every sample")
+    parser.add_argument("--filter", default="", help="filters between the samples and the detector, e.g. 'ma:12' (see filters.py)")
+    parser.add_argument("--compare", action="store_true", help="compare detected beats of the sliding and block thresholds (and --filter) per capture")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(args.captures, args.filter)
+
+    hrv = HRV(block_threshold=args.block_threshold)
+    hrv.verbose = args.verbose
+    start = time.perf_counter()
+    samples = filters.apply(filters.make(args.filter), read_capture(args.captures, args.repeat))
+    hrv, count = replay(samples, hrv)
+    elapsed = time.perf_counter() - start
+
+    signal_seconds = count * sample_interval / 1000
+    beats = hrv.stats.count + hrv.stats.rejected
+    print(f"samples:      {count} ({signal_seconds:.1f} s of signal)")
+    print(f"elapsed:      {elapsed * 1000:.1f} ms")
+    if elapsed > 0:
+        print(f"throughput:   {count / elapsed:.0f} samples/s ({signal_seconds / elapsed:.0f}x real time)")
+    print(f"intervals:    {beats} ({hrv.stats.rejected} rejected)")
+    if hrv.analyze_variability():
+        print("not enough usable intervals for analysis")
+        return 1
+    for key in ("mean_ppi", "mean_hr", "sdnn", "rmssd"):
+        print(f"{key + ':':<13} {hrv.analysis_results[key]}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
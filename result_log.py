@@ -0,0 +1,111 @@
+import struct
+import json
+import os
+
+# Append-only log of analysis results on flash, also used as the measurement
+# history. Every result becomes one fixed-size record, so appending never
+# rewrites earlier data and record i is always at offset i*RECORD_SIZE,
+# which lets the History screen load any page without an index. A small cursor file remembers how many
+# records have been uploaded; flush() publishes the rest in batches.
+
+RECORD = "<IB16s6f3x" # id, type, timestamp, mean_ppi, mean_hr, sdnn, rmssd, sns, pns
+RECORD_SIZE = struct.calcsize(RECORD)
+TYPES = ("local", "kubios")
+NAN = float("nan")
+# The last two values are the Kubios indices of a Kubios result and the
+# estimates of hrv_freq.indices() of a local one
+KEYS = {
+    "local": ("mean_ppi", "mean_hr", "sdnn", "rmssd", "sns_est", "pns_est"),
+    "kubios": ("mean_ppi", "mean_hr", "sdnn", "rmssd", "sns", "pns")
+}
+
+def pack(results):
+    kind = TYPES.index(results.get("type", "local"))
+    timestamp = results.get("timestamp", "").encode()[:16]
+    values = []
+    for key in KEYS[TYPES[kind]]:
+        value = results.get(key)
+        values.append(NAN if value is None else value)
+    return struct.pack(RECORD, results.get("id", 0), kind, timestamp, *values)
+
+def unpack(record):
+    fields = struct.unpack(RECORD, record)
+    results = {
+        "id": fields[0],
+        "type": TYPES[fields[1]],
+        "timestamp": fields[2].rstrip(b"\0").decode()
+    }
+    local = results["type"] == "local"
+    for i, (key, value) in enumerate(zip(KEYS[results["type"]], fields[3:])):
+        if value == value: ## NaN marks a missing value
+            results[key] = int(value) if local and i < 4 else round(value, 3)
+    return results
+
+class ResultLog:
+    def __init__(self, path="results.bin", cursor_path="results.sent", batch=10, device=None):
+        self.path = path
+        self.cursor_path = cursor_path
+        self.batch = batch # records per published message
+        self.device = device # sent along with every record, tells the boards apart
+        self.sent = 0
+        try:
+            with open(cursor_path, "rb") as f:
+                self.sent = struct.unpack("<I", f.read(4))[0]
+        except (OSError, struct.error):
+            pass
+
+    def count(self):
+        try:
+            return os.stat(self.path)[6] // RECORD_SIZE
+        except OSError:
+            return 0
+
+    def append(self, results):
+        with open(self.path, "ab") as f:
+            f.write(pack(results))
+        return self.count() - 1
+
+    def read(self, i, n=1):
+        # n records starting from record i as result dicts
+        records = []
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return records
+        with f:
+            f.seek(i * RECORD_SIZE)
+            for _ in range(n):
+                record = f.read(RECORD_SIZE)
+                if len(record) < RECORD_SIZE:
+                    break
+                records.append(unpack(record))
+        return records
+
+    def pending(self):
+        return self.count() - self.sent
+
+    def mark_sent(self, sent):
+        self.sent = sent
+        with open(self.cursor_path, "wb") as f:
+            f.write(struct.pack("<I", sent))
+
+    def flush(self, session, topic="hr-data", max_batches=1):
+        # Publishes up to max_batches batches of pending records when the
+        # session is connected. A single record goes out as the plain result
+        # object, more as a JSON list. Returns the records sent.
+        sent = 0
+        for _ in range(max_batches):
+            pending = self.pending()
+            if pending <= 0 or not session.connected():
+                break
+            records = self.read(self.sent, min(pending, self.batch))
+            for results in records:
+                del results["type"]
+                if self.device is not None:
+                    results["device"] = self.device
+            message = json.dumps(records[0] if len(records) == 1 else records)
+            if not session.publish(topic, message):
+                break
+            self.mark_sent(self.sent + len(records))
+            sent += len(records)
+        return sent
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+import sim.board as _sim
+from sim.clock import ticks_diff, ticks_add
+from sim.board import reset
+
+# Host simulation of the Pico W and its peripherals. install() puts the fake
+# machine, network, framebuf, ssd1306, piotimer, fifo, led, micropython and
+# umqtt modules in front of sys.path and gives the time module the
+# MicroPython ticks functions on the virtual clock of the current board, so
+# hrv.py runs unchanged. See sim/runner.py for running the UI with scripted
+# input.
+
+MODULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # hrv.py and friends
+PATCHED = ("ticks_ms", "ticks_us", "ticks_cpu", "ticks_diff", "ticks_add", "sleep", "sleep_ms", "sleep_us", "time", "localtime")
+saved = {}
+
+def ticks_ms():
+    return _sim.board.clock.ticks_ms()
+
+def ticks_us():
+    return _sim.board.clock.ticks_us()
+
+def ticks_cpu():
+    return _sim.board.clock.ticks_cpu()
+
+def sleep(seconds):
+    _sim.board.clock.sleep(seconds)
+
+def sleep_ms(ms):
+    _sim.board.clock.sleep_ms(ms)
+
+def sleep_us(us):
+    _sim.board.clock.sleep_us(us)
+
+def virtual_time():
+    return _sim.board.clock.time()
+
+def localtime(secs=None):
+    return _sim.board.clock.localtime(secs)
+
+def install():
+    if saved:
+        return
+    if MODULES not in sys.path:
+        sys.path.insert(0, MODULES)
+    if ROOT not in sys.path:
+        # the firmware runs in its own flash directory, not the checkout
+        sys.path.append(ROOT)
+    functions = {
+        "ticks_ms": ticks_ms, "ticks_us": ticks_us, "ticks_cpu": ticks_cpu,
+        "ticks_diff": ticks_diff, "ticks_add": ticks_add, "sleep": sleep,
+        "sleep_ms": sleep_ms, "sleep_us": sleep_us, "time": virtual_time,
+        "localtime": localtime
+    }
+    for name in PATCHED:
+        saved[name] = getattr(time, name, None)
+        setattr(time, name, functions[name])
+    if _sim.board is None:
+        reset()
+
+def uninstall():
+    for name, value in saved.items():
+        if value is None:
+            delattr(time, name)
+        else:
+            setattr(time, name, value)
+    saved.clear()
+    if MODULES in sys.path:
+        sys.path.remove(MODULES)
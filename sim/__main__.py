@@ -0,0 +1,4 @@
+import sys
+from sim.runner import main
+
+sys.exit(main())
@@ -0,0 +1,95 @@
+from sim.clock import Clock
+from sim.display import Ssd1306Device
+from sim.broker import Broker
+
+# State of the simulated Pico and everything wired to it. The fake modules
+# (machine, network, umqtt, ...) look the current board up here, so the
+# runner and the scenario scripts can drive pins, feed the ADC and inspect
+# the display without the firmware noticing.
+
+board = None # the board of the running simulation
+
+class PinState:
+    def __init__(self):
+        self.value = 0
+        self.handler = None
+        self.trigger = 0
+
+class CaptureSource:
+    # ADC input that replays a capture at its sample rate in virtual time
+    def __init__(self, samples, clock, rate=250, loop=True):
+        self.samples = samples
+        self.clock = clock
+        self.rate = rate
+        self.loop = loop
+        self.start_us = clock.us
+
+    def read(self):
+        i = (self.clock.us - self.start_us) * self.rate // 1000000
+        if i >= len(self.samples):
+            if not self.loop:
+                return self.samples[-1]
+            i %= len(self.samples)
+        return self.samples[i]
+
+class Board:
+    def __init__(self, start_us=0, cpu_scale=None):
+        self.clock = Clock(start_us, cpu_scale)
+        self.pins = {} # pin id -> PinState
+        self.adc = {} # pin id -> source with read()
+        self.i2c = {0x3C: Ssd1306Device()} # address -> device
+        self.networks = {} # visible SSIDs -> password, None accepts any
+        self.scan_ms = 1500 # a WLAN scan blocks this long
+        self.connect_ms = 2000 # association and DHCP
+        self.wlan = None # the fake WLAN that connected last
+        self.broker = Broker(self.clock)
+        self.stats = {"fifo_dropped": 0, "i2c_bytes": 0, "i2c_us": 0, "idle_us": 0}
+
+    @property
+    def display(self):
+        return self.i2c[0x3C]
+
+    def pin(self, id):
+        state = self.pins.get(id)
+        if state is None:
+            state = self.pins[id] = PinState()
+        return state
+
+    def set_pin(self, id, value, pin_class=None):
+        # Drives an input pin and runs its interrupt handler on a matching edge
+        state = self.pin(id)
+        old = state.value
+        state.value = 1 if value else 0
+        if state.handler is None or old == state.value:
+            return
+        edge = 8 if state.value else 4 # Pin.IRQ_RISING, Pin.IRQ_FALLING
+        if state.trigger & edge:
+            if pin_class is None:
+                from machine import Pin as pin_class
+            state.handler(pin_class(id))
+
+    def read_adc(self, id):
+        source = self.adc.get(id)
+        if source is None:
+            return 0
+        return source.read()
+
+    def attach_capture(self, id, samples, rate=250, loop=True):
+        self.adc[id] = CaptureSource(samples, self.clock, rate, loop)
+
+    def wlan_up(self):
+        return self.wlan is not None and self.wlan.isconnected()
+
+    def wlan_visible(self, ssid):
+        return ssid in self.networks
+
+    def wlan_accepts(self, ssid, password):
+        if ssid not in self.networks:
+            return False
+        expected = self.networks[ssid]
+        return expected is None or expected == password
+
+def reset(start_us=0, cpu_scale=None):
+    global board
+    board = Board(start_us, cpu_scale)
+    return board
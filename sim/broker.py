@@ -0,0 +1,102 @@
+import json
+
+# In-memory MQTT broker for the fake umqtt client. Messages are delivered to
+# the inbox of every subscribed client (check_msg() takes them out one at a
+# time, like the real client) and to host-side handlers, which is how the
+# simulation plays the Kubios service or records what the device uploaded.
+
+def topic_matches(pattern, topic):
+    pattern = pattern.split("/")
+    topic = topic.split("/")
+    for i, part in enumerate(pattern):
+        if part == "#":
+            return True
+        if i >= len(topic) or (part != "+" and part != topic[i]):
+            return False
+    return len(pattern) == len(topic)
+
+def to_bytes(value):
+    if isinstance(value, str):
+        return value.encode()
+    return bytes(value)
+
+class Broker:
+    def __init__(self, clock):
+        self.clock = clock
+        self.online = True # reachable from the device
+        self.clients = [] # connected fake MQTTClients
+        self.handlers = [] # (pattern, callback(topic, msg)) on the host side
+        self.published = [] # (us, topic, msg) of every message
+        self.keep_log = True
+
+    def connect(self, client):
+        if client not in self.clients:
+            self.clients.append(client)
+
+    def disconnect(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def subscribe(self, pattern, callback):
+        # host-side subscription, callback(topic, msg) gets str and bytes
+        self.handlers.append((pattern, callback))
+
+    def publish(self, topic, msg):
+        topic = topic.decode() if isinstance(topic, bytes) else topic
+        msg = to_bytes(msg)
+        if self.keep_log:
+            self.published.append((self.clock.us, topic, msg))
+        for client in self.clients:
+            for pattern in client.subscriptions:
+                if topic_matches(pattern, topic):
+                    client.inbox.append((topic.encode(), msg))
+                    break
+        for pattern, callback in self.handlers:
+            if topic_matches(pattern, topic):
+                callback(topic, msg)
+
+    def messages(self, pattern="#"):
+        return [(us, topic, msg) for us, topic, msg in self.published if topic_matches(pattern, topic)]
+
+class KubiosService:
+    # Answers "kubios-request" messages after a delay with a readiness
+    # analysis of the PPI list. Time-domain values are computed from the
+    # intervals, SNS and PNS are rough stand-ins scaled from heart rate and
+    # RMSSD, good enough to drive the result screens.
+    def __init__(self, broker, delay_ms=1500, request_topic="kubios-request", response_topic="kubios-response"):
+        self.broker = broker
+        self.delay_ms = delay_ms
+        self.response_topic = response_topic
+        self.requests = 0
+        self.fail = False # reply without an analysis
+        broker.subscribe(request_topic, self.request)
+
+    def request(self, topic, msg):
+        self.requests += 1
+        try:
+            request = json.loads(msg)
+        except ValueError:
+            return
+        reply = {"id": request.get("id"), "type": "RRI", "data": {"status": "ok", "analysis": self.analyze(request.get("data") or [])}}
+        if self.fail:
+            reply["data"] = {"status": "error", "error": "analysis failed"}
+        message = json.dumps(reply)
+        self.broker.clock.schedule(self.delay_ms * 1000, lambda: self.broker.publish(self.response_topic, message))
+
+    def analyze(self, ppi):
+        n = len(ppi)
+        if n < 2:
+            return {}
+        mean = sum(ppi) / n
+        sdnn = (sum((p - mean) ** 2 for p in ppi) / (n - 1)) ** 0.5
+        rmssd = (sum((ppi[i + 1] - ppi[i]) ** 2 for i in range(n - 1)) / (n - 1)) ** 0.5
+        hr = 60000 / mean
+        return {
+            "mean_hr_bpm": hr,
+            "mean_rr_ms": mean,
+            "rmssd_ms": rmssd,
+            "sdnn_ms": sdnn,
+            "sns_index": (hr - 70) / 10,
+            "pns_index": (rmssd - 40) / 20,
+            "create_timestamp": "simulated"
+        }
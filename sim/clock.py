@@ -0,0 +1,143 @@
+import heapq
+import time
+
+# Virtual time of the simulation. Nothing happens between two calls into the
+# fake hardware: time only moves when the firmware sleeps, busy-polls a FIFO,
+# talks to the display over I2C or when the runner charges a pass of the UI
+# its CPU time. Timers and scripted input are events on the same
+# clock, so a run is fully deterministic.
+#
+# The ticks_* functions follow MicroPython, including the wrap-around of the
+# millisecond and microsecond counters at 2**30.
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+EPOCH = 1767225600 # time.time() at the start of a run (2026-01-01 00:00:00)
+
+class SimulationEnd(BaseException):
+    # Raised when the run reaches its end time. A BaseException so that
+    # firmware code catching Exception cannot swallow it.
+    pass
+
+class Clock:
+    def __init__(self, start_us=0, cpu_scale=None):
+        self.us = start_us
+        self.start_us = start_us
+        self.events = [] # heap of [due, seq, callback, period, active]
+        self.seq = 0
+        self.deadline = None # us, SimulationEnd once time would pass it
+        self.busy = False ## inside an event callback
+        # Optional: also charge the host CPU time used by the firmware,
+        # multiplied by cpu_scale (not deterministic)
+        self.cpu_scale = cpu_scale
+        self.host = time.perf_counter()
+
+    def schedule(self, delay_us, callback, period_us=0):
+        # callback() runs once delay_us from now, then every period_us if set.
+        # Returns a handle for cancel().
+        event = [self.us + delay_us, self.seq, callback, period_us, True]
+        self.seq += 1
+        heapq.heappush(self.events, event)
+        return event
+
+    def cancel(self, event):
+        if event is not None:
+            event[4] = False
+
+    def sync(self):
+        if self.cpu_scale:
+            now = time.perf_counter()
+            spent = (now - self.host) * 1e6 * self.cpu_scale
+            self.host = now
+            if spent >= 1:
+                self.spend(int(spent))
+
+    def spend(self, us):
+        # Lets us microseconds pass, firing the events due in between
+        if self.busy:
+            # hardware calls from an interrupt handler do not move time
+            return
+        self.run_until(self.us + us)
+
+    def run_until(self, target):
+        if self.deadline is not None and target > self.deadline:
+            self.run_until(self.deadline)
+            raise SimulationEnd()
+        events = self.events
+        while events and events[0][0] <= target:
+            event = heapq.heappop(events)
+            if not event[4]:
+                continue
+            if event[0] > self.us:
+                self.us = event[0]
+            if event[3]:
+                event[0] += event[3]
+                event[1] = self.seq
+                self.seq += 1
+                heapq.heappush(events, event)
+            else:
+                event[4] = False
+            self.busy = True
+            try:
+                event[2]()
+            finally:
+                self.busy = False
+        if target > self.us:
+            self.us = target
+
+    def idle(self, target=None):
+        # Lets time pass until target (us) or the next event, whichever is
+        # first. With neither, the run can only end.
+        events = self.events
+        while events and not events[0][4]:
+            heapq.heappop(events)
+        if events and (target is None or events[0][0] < target):
+            target = max(events[0][0], self.us)
+        if target is None:
+            if self.deadline is None:
+                raise RuntimeError("nothing left to wait for")
+            target = self.deadline + 1
+        self.run_until(target)
+
+    def elapsed_us(self):
+        return self.us - self.start_us
+
+    # MicroPython time functions
+
+    def ticks_us(self):
+        self.sync()
+        return self.us & TICKS_MAX
+
+    def ticks_ms(self):
+        self.sync()
+        return (self.us // 1000) & TICKS_MAX
+
+    def ticks_cpu(self):
+        return self.ticks_us()
+
+    def time(self):
+        return EPOCH + self.elapsed_us() // 1000000
+
+    def time_ns(self):
+        return EPOCH * 1000000000 + self.elapsed_us() * 1000
+
+    def localtime(self, secs=None):
+        if secs is None:
+            secs = self.time()
+        return tuple(time.gmtime(secs))[:8]
+
+    def sleep(self, seconds):
+        self.spend(int(seconds * 1000000))
+
+    def sleep_ms(self, ms):
+        self.spend(ms * 1000)
+
+    def sleep_us(self, us):
+        self.spend(us)
+
+def ticks_diff(end, start):
+    return ((end - start + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
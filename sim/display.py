@@ -0,0 +1,122 @@
+import struct
+import zlib
+
+# Model of the SSD1306 controller on the I2C bus. It decodes the command and
+# data stream the driver sends into its own display RAM, so dumps show what
+# the panel would show, including anything a partial update got wrong.
+
+SET_MEM_ADDR = 0x20
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+# commands followed by argument bytes, everything else takes none
+ARGUMENTS = {0x20: 1, 0x21: 2, 0x22: 2, 0x81: 1, 0x8D: 1, 0xA8: 1, 0xD3: 1, 0xD5: 1, 0xD9: 1, 0xDA: 1, 0xDB: 1}
+
+class Ssd1306Device:
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.ram = bytearray(width * self.pages)
+        self.on = False
+        self.column_range = (0, width - 1)
+        self.page_range = (0, self.pages - 1)
+        self.column = 0
+        self.page = 0
+        self.command = None # command waiting for its arguments
+        self.arguments = []
+        self.data_bytes = 0
+
+    def write(self, data):
+        # One I2C transaction. The first byte is the control byte: 0x80 or
+        # 0x00 for commands, 0x40 for display data.
+        if not data:
+            return
+        control = data[0]
+        if control & 0x40:
+            self.write_data(data[1:])
+        else:
+            for byte in data[1:]:
+                self.write_command(byte)
+
+    def write_command(self, byte):
+        if self.command is not None:
+            self.arguments.append(byte)
+            if len(self.arguments) < ARGUMENTS[self.command]:
+                return
+            command = self.command
+            arguments = self.arguments
+            self.command = None
+            self.arguments = []
+            if command == SET_COL_ADDR:
+                self.column_range = (arguments[0], arguments[1])
+                self.column = arguments[0]
+            elif command == SET_PAGE_ADDR:
+                self.page_range = (arguments[0], arguments[1])
+                self.page = arguments[0]
+            return
+        if byte in ARGUMENTS:
+            self.command = byte
+        elif byte == 0xAE:
+            self.on = False
+        elif byte == 0xAF:
+            self.on = True
+
+    def write_data(self, data):
+        # horizontal addressing mode, the only one the driver uses
+        first, last = self.column_range
+        top, bottom = self.page_range
+        for byte in data:
+            if self.column < self.width and self.page < self.pages:
+                self.ram[self.page * self.width + self.column] = byte
+            self.column += 1
+            if self.column > last:
+                self.column = first
+                self.page += 1
+                if self.page > bottom:
+                    self.page = top
+        self.data_bytes += len(data)
+
+    def pixel(self, x, y):
+        return (self.ram[(y >> 3) * self.width + x] >> (y & 7)) & 1
+
+    def ascii(self):
+        return ascii_frame(self.ram, self.width, self.height)
+
+    def png(self, path, scale=4):
+        write_png(path, self.ram, self.width, self.height, scale)
+
+def ascii_frame(buffer, width, height):
+    # Two pixel rows per text line
+    chars = " '.:"
+    lines = []
+    for y in range(0, height, 2):
+        line = []
+        for x in range(width):
+            top = (buffer[(y >> 3) * width + x] >> (y & 7)) & 1
+            bottom = 0
+            if y + 1 < height:
+                bottom = (buffer[((y + 1) >> 3) * width + x] >> ((y + 1) & 7)) & 1
+            line.append(chars[top | bottom << 1])
+        lines.append("".join(line).rstrip())
+    return "\n".join(lines)
+
+def write_png(path, buffer, width, height, scale=4):
+    # 8-bit grayscale PNG of a MONO_VLSB buffer, lit pixels white
+    rows = []
+    for y in range(height):
+        row = bytearray()
+        for x in range(width):
+            lit = (buffer[(y >> 3) * width + x] >> (y & 7)) & 1
+            row += (b"\xff" if lit else b"\x00") * scale
+        row = b"\x00" + bytes(row) # filter type none
+        rows.append(row * scale)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width * scale, height * scale, 8, 0, 0, 0, 0)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", header))
+        f.write(chunk(b"IDAT", zlib.compress(b"".join(rows))))
+        f.write(chunk(b"IEND", b""))
@@ -0,0 +1,41 @@
+from array import array
+import sim.board as _sim
+
+# Fake of the pico-lib Fifo. Same ring buffer, but every poll from the main
+# loop costs a little virtual time so that busy-wait loops make progress,
+# and dropped values are also counted on the board.
+
+POLL_US = 10 # roughly one MicroPython method call
+
+class Fifo:
+    def __init__(self, size, typecode = 'H'):
+        self.data = array(typecode, [0] * size)
+        self.head = 0
+        self.tail = 0
+        self.size = size
+        self.dc = 0
+
+    def put(self, value):
+        nh = (self.head + 1) % self.size
+        if nh != self.tail:
+            self.data[self.head] = value
+            self.head = nh
+        else:
+            self.dc += 1
+            _sim.board.stats["fifo_dropped"] += 1
+
+    def get(self):
+        val = self.data[self.tail]
+        self.tail = (self.tail + 1) % self.size
+        return val
+
+    def dropped(self):
+        return self.dc
+
+    def has_data(self):
+        _sim.board.clock.spend(POLL_US)
+        return self.head != self.tail
+
+    def empty(self):
+        _sim.board.clock.spend(POLL_US)
+        return self.head == self.tail
@@ -0,0 +1,174 @@
+# Fake of the MicroPython framebuf module, MONO_VLSB only (the SSD1306
+# layout). Text uses a 3x5 font in the 8x8 cell so that dumps stay readable;
+# lowercase is drawn as uppercase.
+
+MONO_VLSB = 0
+MVLSB = MONO_VLSB
+
+# rows of 3 bits, most significant bit left
+FONT = {
+    "0": "75557", "1": "26227", "2": "71747", "3": "71317", "4": "55711",
+    "5": "74717", "6": "74757", "7": "71122", "8": "75757", "9": "75717",
+    "A": "25755", "B": "65656", "C": "34443", "D": "65556", "E": "74647",
+    "F": "74644", "G": "34553", "H": "55755", "I": "72227", "J": "11152",
+    "K": "55655", "L": "44447", "M": "57755", "N": "65555", "O": "25552",
+    "P": "65644", "Q": "25563", "R": "65655", "S": "34216", "T": "72222",
+    "U": "55557", "V": "55552", "W": "55775", "X": "55255", "Y": "55222",
+    "Z": "71247", ".": "00002", ":": "02020", "-": "00700", ">": "42124",
+    "<": "12421", "/": "11244", "%": "51245", "*": "05250", "(": "12221",
+    ")": "42224", "+": "02720", "=": "07070", "_": "00007", ",": "00024",
+    "!": "22202", "?": "61202", "'": "22000", " ": "00000",
+}
+UNKNOWN = "77777"
+columns = {} # char -> the 3 glyph columns as 5-bit VLSB values
+
+def glyph_columns(ch):
+    result = columns.get(ch)
+    if result is None:
+        glyph = FONT.get(ch.upper(), UNKNOWN)
+        result = []
+        for col in range(3):
+            bits = 0
+            for row in range(5):
+                if (ord(glyph[row]) - 48) & (4 >> col):
+                    bits |= 1 << row
+            result.append(bits)
+        columns[ch] = result
+    return result
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format=MONO_VLSB, stride=None):
+        if format != MONO_VLSB:
+            raise ValueError("only MONO_VLSB is simulated")
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.stride = stride or width
+
+    def fill(self, c):
+        v = 0xff if c else 0
+        n = self.stride * ((self.height + 7) // 8)
+        self.buffer[0:n] = bytes([v]) * n
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        i = (y >> 3) * self.stride + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buffer[i] & bit else 0
+        if c:
+            self.buffer[i] |= bit
+        else:
+            self.buffer[i] &= ~bit & 0xff
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.fill_rect(x, y, w, 1, c)
+        self.fill_rect(x, y + h - 1, w, 1, c)
+        self.fill_rect(x, y, 1, h, c)
+        self.fill_rect(x + w - 1, y, 1, h, c)
+
+    def fill_rect(self, x, y, w, h, c):
+        x0 = max(x, 0)
+        x1 = min(x + w, self.width)
+        y0 = max(y, 0)
+        y1 = min(y + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        buf = self.buffer
+        for yy in range(y0, y1):
+            row = (yy >> 3) * self.stride
+            bit = 1 << (yy & 7)
+            if c:
+                for i in range(row + x0, row + x1):
+                    buf[i] |= bit
+            else:
+                mask = ~bit & 0xff
+                for i in range(row + x0, row + x1):
+                    buf[i] &= mask
+
+    def line(self, x0, y0, x1, y1, c):
+        dx = abs(x1 - x0)
+        dy = -abs(y1 - y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x0, y0, c)
+            if x0 == x1 and y0 == y1:
+                return
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def text(self, s, x, y, c=1):
+        # glyph columns are or'ed into the (at most two) pages they cover
+        y += 1
+        if y >= self.height or y + 5 <= 0:
+            return
+        buf = self.buffer
+        page = y >> 3
+        shift = y & 7
+        for ch in str(s):
+            for col, bits in enumerate(glyph_columns(ch)):
+                xx = x + 2 + col
+                if not bits or not 0 <= xx < self.width:
+                    continue
+                mask = bits << shift
+                for p in (page, page + 1):
+                    part = mask & 0xff
+                    mask >>= 8
+                    if part and 0 <= p and (p << 3) < self.height:
+                        i = p * self.stride + xx
+                        if c:
+                            buf[i] |= part
+                        else:
+                            buf[i] &= ~part & 0xff
+            x += 8
+
+    def scroll(self, dx, dy):
+        if dy:
+            # rarely used, plain pixel copy
+            copy = FrameBuffer(bytearray(self.buffer), self.width, self.height, MONO_VLSB, self.stride)
+            for y in range(self.height):
+                for x in range(self.width):
+                    if 0 <= x - dx < self.width and 0 <= y - dy < self.height:
+                        self.pixel(x, y, copy.pixel(x - dx, y - dy))
+            return
+        if not dx:
+            return
+        # like framebuf, the uncovered columns keep their old content
+        for page in range((self.height + 7) // 8):
+            row = page * self.stride
+            line = self.buffer[row:row + self.width]
+            if dx < 0:
+                self.buffer[row:row + self.width + dx] = line[-dx:]
+            else:
+                self.buffer[row + dx:row + self.width] = line[:self.width - dx]
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        if key == -1 and y & 7 == 0 and 0 <= x and x + fbuf.width <= self.width and fbuf.height & 7 == 0:
+            # page aligned, whole bytes
+            for page in range(min(fbuf.height, self.height - y) >> 3):
+                row = (page + (y >> 3)) * self.stride + x
+                src = page * fbuf.stride
+                self.buffer[row:row + fbuf.width] = fbuf.buffer[src:src + fbuf.width]
+            return
+        for yy in range(fbuf.height):
+            for xx in range(fbuf.width):
+                c = fbuf.pixel(xx, yy)
+                if c != key:
+                    self.pixel(x + xx, y + yy, c)
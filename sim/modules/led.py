@@ -0,0 +1,13 @@
+from machine import Pin
+
+# Fake of the pico-lib Led, an output pin with a brightness setting
+
+class Led(Pin):
+    def __init__(self, id, mode = Pin.OUT, brightness = 1):
+        super().__init__(id, mode)
+        self.br = brightness
+
+    def brightness(self, value = None):
+        if value is None:
+            return self.br
+        self.br = value
@@ -0,0 +1,151 @@
+import sim.board as _sim
+
+# Fake of the MicroPython machine module for the simulated Pico
+
+def freq(hz=None):
+    return 125000000
+
+def unique_id():
+    return b"\xe6\x61\x41\x04\x03\x5a\x2b\x21"
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+def idle():
+    _sim.board.clock.spend(10)
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        state = _sim.board.pin(self.id)
+        if pull == self.PULL_UP:
+            state.value = 1
+        elif pull == self.PULL_DOWN:
+            state.value = 0
+        if value is not None:
+            state.value = 1 if value else 0
+
+    def value(self, value=None):
+        if value is None:
+            return _sim.board.pin(self.id).value
+        _sim.board.set_pin(self.id, value, Pin)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    high = on
+    low = off
+
+    def toggle(self):
+        self.value(1 - self.value())
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        state = _sim.board.pin(self.id)
+        state.handler = handler
+        state.trigger = trigger
+
+    def __repr__(self):
+        return f"Pin({self.id})"
+
+class ADC:
+    CORE_TEMP = 4
+
+    def __init__(self, pin):
+        # ADC(Pin(26..29)) or ADC(channel)
+        if isinstance(pin, Pin):
+            self.id = pin.id
+        else:
+            self.id = pin + 26 if pin < 5 else pin
+
+    def read_u16(self):
+        return _sim.board.read_adc(self.id) & 0xffff
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400000, timeout=50000):
+        self.id = id
+        self.freq = freq
+
+    def scan(self):
+        return sorted(_sim.board.i2c)
+
+    def transfer(self, addr, data):
+        board = _sim.board
+        device = board.i2c.get(addr)
+        # address byte plus data, 9 clocks per byte
+        us = (len(data) + 1) * 9 * 1000000 // self.freq
+        board.stats["i2c_bytes"] += len(data)
+        board.stats["i2c_us"] += us
+        board.clock.spend(us)
+        if device is None:
+            raise OSError(5) # EIO, nobody acknowledged the address
+        device.write(data)
+
+    def writeto(self, addr, buf, stop=True):
+        self.transfer(addr, bytes(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        self.transfer(addr, b"".join(bytes(buf) for buf in vector))
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, freq=-1, callback=None, tick_hz=1000):
+        self.event = None
+        if callback is not None:
+            self.init(mode=mode, period=period, freq=freq, callback=callback, tick_hz=tick_hz)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None, tick_hz=1000):
+        self.deinit()
+        if freq > 0:
+            us = 1000000 // freq
+        else:
+            us = period * 1000000 // tick_hz
+        self.callback = callback
+        clock = _sim.board.clock
+        self.event = clock.schedule(us, self.fire, us if mode == self.PERIODIC else 0)
+
+    def fire(self):
+        if self.callback is not None:
+            self.callback(self)
+
+    def deinit(self):
+        if self.event is not None:
+            _sim.board.clock.cancel(self.event)
+            self.event = None
+
+class UART:
+    def __init__(self, id, baudrate=115200, **kwargs):
+        self.id = id
+        self.rx = bytearray()
+
+    def write(self, buf):
+        return len(buf)
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, n=-1):
+        if not self.rx:
+            return None
+        data = bytes(self.rx if n < 0 else self.rx[:n])
+        del self.rx[:len(data)]
+        return data
@@ -0,0 +1,17 @@
+# Fake of the micropython module. It has no code emitters, like the real
+# one: modules that use @micropython.viper bring their own CPython shim.
+
+def const(value):
+    return value
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def schedule(func, arg):
+    func(arg)
+
+def mem_info(verbose=None):
+    pass
+
+def opt_level(level=None):
+    return 0
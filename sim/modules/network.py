@@ -0,0 +1,72 @@
+import sim.board as _sim
+
+# Fake of the Pico W network module. The visible networks and how long
+# scanning and connecting take are set on the board.
+
+STA_IF = 0
+AP_IF = 1
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self.up = False
+        self.ssid = None
+        self.connected_at = None # us when the connection comes up
+        self.failed = STAT_IDLE
+
+    def active(self, value=None):
+        if value is None:
+            return self.up
+        self.up = bool(value)
+
+    def scan(self):
+        board = _sim.board
+        board.clock.spend(board.scan_ms * 1000)
+        return [(ssid.encode(), b"\x00\x11\x22\x33\x44\x55", 6, -60, 3, 0) for ssid in board.networks]
+
+    def connect(self, ssid, key=None):
+        board = _sim.board
+        board.wlan = self
+        self.ssid = ssid
+        self.connected_at = None
+        if not board.wlan_visible(ssid):
+            self.failed = STAT_NO_AP_FOUND
+        elif not board.wlan_accepts(ssid, key):
+            self.failed = STAT_WRONG_PASSWORD
+        else:
+            self.failed = STAT_IDLE
+            self.connected_at = board.clock.us + board.connect_ms * 1000
+
+    def disconnect(self):
+        self.connected_at = None
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -60
+        if self.connected_at is None:
+            return self.failed
+        return STAT_GOT_IP if self.isconnected() else STAT_CONNECTING
+
+    def isconnected(self):
+        _sim.board.clock.sync()
+        return self.up and self.connected_at is not None and _sim.board.clock.us >= self.connected_at
+
+    def ifconfig(self, config=None):
+        if self.isconnected():
+            return ("192.168.5.42", "255.255.255.0", "192.168.5.1", "192.168.5.1")
+        return ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+    def config(self, *args, **kwargs):
+        if args == ("mac",):
+            return b"\x28\xcd\xc1\x00\x00\x01"
+        if args == ("ssid",):
+            return self.ssid
+
+    def __repr__(self):
+        return f"<CYW43 STA {'up' if self.isconnected() else 'down'} {self.ifconfig()[0]}>"
@@ -0,0 +1,8 @@
+from machine import Timer
+
+# Fake of the pico-lib PIO timer, a periodic timer with the machine.Timer
+# interface (period in ms or freq in Hz)
+
+class Piotimer(Timer):
+    def __init__(self, sm_id=0, mode=Timer.PERIODIC, freq=-1, period=-1, callback=None):
+        super().__init__(mode=mode, period=period, freq=freq, callback=callback)
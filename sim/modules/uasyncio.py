@@ -0,0 +1,284 @@
+import heapq
+from collections import deque
+import sim.board as _sim
+
+# Fake of MicroPython's uasyncio on the virtual clock. Tasks are CPython
+# coroutines stepped by a small scheduler; when no task is ready the clock
+# jumps to the next sleeper or interrupt, and the time spent there is
+# counted as idle on the board. ThreadSafeFlag.set() may be called from the
+# simulated interrupt handlers.
+
+class CancelledError(BaseException):
+    pass
+
+class TimeoutError(Exception):
+    pass
+
+class Suspend:
+    # what a task waits for: ("sleep", us), ("wake", None) or ("join", task, timeout_us)
+    def __init__(self, *request):
+        self.request = request
+
+    def __await__(self):
+        value = yield self
+        return value
+
+class Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.state = True # True while running
+        self.data = None # result or exception
+        self.waiting = [] # tasks joined on this one
+        self.token = 0 # invalidates stale wake-ups
+
+    def done(self):
+        return not self.state
+
+    def cancel(self):
+        if self.state:
+            loop().wake(self, CancelledError())
+            return True
+        return False
+
+    def __await__(self):
+        if self.state:
+            yield Suspend("join", self, None)
+        if isinstance(self.data, BaseException):
+            raise self.data
+        return self.data
+
+class Loop:
+    def __init__(self):
+        self.ready = deque() # (task, token, value or exception)
+        self.sleeping = [] # heap of (wake us, seq, task, token)
+        self.seq = 0
+        self.current = None
+
+    def create_task(self, coro):
+        task = Task(coro)
+        self.ready.append((task, task.token, None))
+        return task
+
+    def wake(self, task, value=None):
+        task.token += 1
+        self.ready.append((task, task.token, value))
+
+    def sleep(self, task, us):
+        heapq.heappush(self.sleeping, (_sim.board.clock.us + us, self.seq, task, task.token))
+        self.seq += 1
+
+    def finish(self, task, data):
+        task.state = False
+        task.data = data
+        for waiter in task.waiting:
+            self.wake(waiter)
+        if isinstance(data, Exception) and not task.waiting:
+            print("Task exception wasn't retrieved:", repr(data))
+
+    def step(self, task, value):
+        self.current = task
+        try:
+            if isinstance(value, BaseException):
+                request = task.coro.throw(value)
+            else:
+                request = task.coro.send(value)
+        except StopIteration as e:
+            self.finish(task, e.value)
+            return
+        except (CancelledError, Exception) as e:
+            self.finish(task, e)
+            return
+        finally:
+            self.current = None
+        if request is None:
+            # plain yield, run again after the others
+            self.wake(task)
+            return
+        kind = request.request[0]
+        if kind == "sleep":
+            self.sleep(task, request.request[1])
+        elif kind == "join":
+            other = request.request[1]
+            other.waiting.append(task)
+            if request.request[2] is not None:
+                self.sleep(task, request.request[2])
+        # "wake": whoever holds the task wakes it
+
+    def run_until_complete(self, main):
+        clock = _sim.board.clock
+        stats = _sim.board.stats
+        while main.state:
+            if self.ready:
+                task, token, value = self.ready.popleft()
+                if task.state and token == task.token:
+                    self.step(task, value)
+                continue
+            if self.sleeping and self.sleeping[0][0] <= clock.us:
+                wake, seq, task, token = heapq.heappop(self.sleeping)
+                if task.state and token == task.token:
+                    self.wake(task)
+                continue
+            # idle until the next sleeper or interrupt
+            start = clock.us
+            clock.idle(self.sleeping[0][0] if self.sleeping else None)
+            stats["idle_us"] += clock.us - start
+        if isinstance(main.data, BaseException):
+            raise main.data
+        return main.data
+
+current_loop = None
+
+def loop():
+    global current_loop
+    if current_loop is None:
+        current_loop = Loop()
+    return current_loop
+
+def new_event_loop():
+    global current_loop
+    current_loop = Loop()
+    return current_loop
+
+def get_event_loop():
+    return loop()
+
+def create_task(coro):
+    return loop().create_task(coro)
+
+def current_task():
+    return loop().current
+
+def run(coro):
+    return loop().run_until_complete(create_task(coro))
+
+async def sleep_ms(ms):
+    await Suspend("sleep", int(ms) * 1000)
+
+async def sleep(seconds):
+    await Suspend("sleep", int(seconds * 1000000))
+
+async def wait_for_ms(awaitable, timeout):
+    task = awaitable if isinstance(awaitable, Task) else create_task(awaitable)
+    if task.state:
+        await Suspend("join", task, int(timeout) * 1000)
+    if task.state:
+        # woken by the timeout
+        task.cancel()
+        raise TimeoutError()
+    if isinstance(task.data, BaseException):
+        raise task.data
+    return task.data
+
+async def wait_for(awaitable, timeout):
+    return await wait_for_ms(awaitable, timeout * 1000)
+
+async def gather(*awaitables, return_exceptions=False):
+    results = []
+    tasks = [a if isinstance(a, Task) else create_task(a) for a in awaitables]
+    for task in tasks:
+        try:
+            results.append(await task)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+class Stream:
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+async def open_connection(host, port):
+    # Non-blocking TCP connect. The broker is the only host on the fake
+    # network: one round trip when it is online, otherwise the task waits
+    # for lwIP's connect timeout while the other tasks run.
+    from umqtt.simple import ROUND_TRIP_US, CONNECT_TIMEOUT_US
+    board = _sim.board
+    if not board.wlan_up():
+        raise OSError(113) # EHOSTUNREACH
+    if not board.broker.online:
+        await Suspend("sleep", CONNECT_TIMEOUT_US)
+        raise OSError(110) # ETIMEDOUT
+    await Suspend("sleep", ROUND_TRIP_US)
+    return Stream(), Stream()
+
+class ThreadSafeFlag:
+    # One waiter. set() from an interrupt handler wakes it or is remembered
+    # for the next wait().
+    def __init__(self):
+        self.state = False
+        self.waiter = None
+
+    def set(self):
+        if self.waiter is not None:
+            task = self.waiter
+            self.waiter = None
+            loop().wake(task)
+        else:
+            self.state = True
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        if self.state:
+            self.state = False
+            return
+        self.waiter = loop().current
+        try:
+            await Suspend("wake", None)
+        finally:
+            if self.waiter is loop().current:
+                self.waiter = None
+
+class Event:
+    def __init__(self):
+        self.state = False
+        self.waiting = []
+
+    def is_set(self):
+        return self.state
+
+    def set(self):
+        self.state = True
+        for task in self.waiting:
+            loop().wake(task)
+        self.waiting = []
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        if not self.state:
+            self.waiting.append(loop().current)
+            await Suspend("wake", None)
+        return True
+
+class Lock:
+    def __init__(self):
+        self.state = False
+        self.waiting = []
+
+    def locked(self):
+        return self.state
+
+    async def acquire(self):
+        while self.state:
+            self.waiting.append(loop().current)
+            await Suspend("wake", None)
+        self.state = True
+        return True
+
+    def release(self):
+        self.state = False
+        if self.waiting:
+            loop().wake(self.waiting.pop(0))
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, *args):
+        self.release()
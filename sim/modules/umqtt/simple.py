@@ -0,0 +1,92 @@
+import sim.board as _sim
+
+# Fake of umqtt.simple talking to the in-memory broker of the board.
+# Connecting fails like a socket error unless the WLAN is up and the broker
+# is online; every call costs a network round trip of virtual time. Like the
+# real blocking socket connect, an offline broker holds the caller until the
+# socket timeout (or lwIP's own connect timeout without one) runs out.
+
+ROUND_TRIP_US = 5000
+CONNECT_TIMEOUT_US = 20000000 # lwIP gives up on an unanswered SYN after about this long
+
+class MQTTException(Exception):
+    pass
+
+class Socket:
+    def __init__(self, client):
+        self.client = client
+
+    def close(self):
+        _sim.board.broker.disconnect(self.client)
+        self.client.open = False
+
+    def setblocking(self, flag):
+        pass
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0, ssl=None, ssl_params={}):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.cb = None
+        self.sock = None
+        self.open = False
+        self.subscriptions = []
+        self.inbox = []
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def check(self):
+        board = _sim.board
+        board.clock.spend(ROUND_TRIP_US)
+        if not self.open or not board.broker.online or not board.wlan_up():
+            self.open = False
+            board.broker.disconnect(self)
+            raise OSError(104) # ECONNRESET
+
+    def connect(self, clean_session=True, timeout=None):
+        board = _sim.board
+        board.clock.spend(ROUND_TRIP_US)
+        if not board.wlan_up():
+            raise OSError(113) # EHOSTUNREACH
+        if not board.broker.online:
+            board.clock.spend(int(timeout * 1000000) if timeout is not None else CONNECT_TIMEOUT_US)
+            raise OSError(110) # ETIMEDOUT
+        self.sock = Socket(self)
+        self.open = True
+        if clean_session:
+            self.subscriptions = []
+            self.inbox = []
+        board.broker.connect(self)
+        return False
+
+    def disconnect(self):
+        if self.open:
+            self.sock.close()
+
+    def ping(self):
+        self.check()
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self.check()
+        _sim.board.broker.publish(topic, msg)
+
+    def subscribe(self, topic, qos=0):
+        self.check()
+        topic = topic.decode() if isinstance(topic, bytes) else topic
+        if topic not in self.subscriptions:
+            self.subscriptions.append(topic)
+
+    def check_msg(self):
+        self.check()
+        if self.inbox:
+            topic, msg = self.inbox.pop(0)
+            if self.cb is not None:
+                self.cb(topic, msg)
+
+    def wait_msg(self):
+        while not self.inbox:
+            self.check()
+        self.check_msg()
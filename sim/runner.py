@@ -0,0 +1,264 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import sim
+from sim.broker import KubiosService
+
+# Runs the firmware in hrv.py on the simulated board: boots like main(),
+# presses buttons and turns the encoder from a script, replays a capture into
+# the pulse sensor ADC and reports where the virtual time went.
+#
+# A script is a comma separated list of actions run one after another:
+# "right", "left" and "press" act on the encoder, "hold:<pin>" and
+# "release:<pin>" push and let go of a button (SW0 is pin 9, SW2 pin 7),
+# "wait:<ms>" pauses. Actions
+# are spaced by the script gap (300 ms, longer than the button debounce),
+# the first one comes one gap after boot.
+# The default script opens "2.HRV analysis", measures for 30 s and returns
+# to the menu from the results.
+
+DEFAULT_SCRIPT = "right, press, press, wait:33000, press"
+ENCODER_PINS = (10, 11, 12) # rotary A, rotary B, button as in main()
+SENSOR_PIN = 27
+
+class ScriptedEncoder:
+    def __init__(self, board, a=ENCODER_PINS[0], b=ENCODER_PINS[1], button=ENCODER_PINS[2], press_ms=80):
+        self.board = board
+        self.a = a
+        self.b = b
+        self.button = button
+        self.press_ms = press_ms
+
+    def turn(self, step):
+        # the firmware reads B on the rising edge of A
+        self.board.set_pin(self.b, 0 if step > 0 else 1)
+        self.board.set_pin(self.a, 1)
+        self.board.set_pin(self.a, 0)
+
+    def right(self):
+        self.turn(1)
+
+    def left(self):
+        self.turn(-1)
+
+    def press(self):
+        self.board.set_pin(self.button, 0)
+        self.board.clock.schedule(self.press_ms * 1000, lambda: self.board.set_pin(self.button, 1))
+
+def parse_script(script):
+    actions = []
+    for token in script.split(","):
+        token = token.strip()
+        if not token:
+            continue
+        if token.startswith("wait:"):
+            actions.append(("wait", int(token[5:])))
+        elif token.startswith(("hold:", "release:")):
+            action, pin = token.split(":")
+            actions.append((action, int(pin)))
+        elif token in ("right", "left", "press"):
+            actions.append((token, 0))
+        else:
+            raise ValueError(f"unknown script action: {token}")
+    return actions
+
+def load_samples(paths):
+    from capture import iter_samples
+    samples = []
+    for path in paths:
+        samples.extend(iter_samples(path))
+    return samples
+
+class Simulation:
+    def __init__(self, captures=(), workdir=None, start_us=0, cpu_scale=None, loop_us=200,
+                 wifi=True, broker=True, kubios_delay_ms=1500, quiet=True):
+        sim.install()
+        self.board = sim.reset(start_us, cpu_scale)
+        self.loop_us = loop_us # virtual CPU time of one UI.display() pass
+        self.quiet = quiet
+        self.output = io.StringIO() # firmware prints when quiet
+        self.workdir = workdir or tempfile.mkdtemp(prefix="hrv-sim-")
+        self.encoder = ScriptedEncoder(self.board)
+        self.board.broker.online = broker
+        self.kubios = KubiosService(self.board.broker, kubios_delay_ms)
+        if captures:
+            self.board.attach_capture(SENSOR_PIN, load_samples(captures))
+        self.screens = [] # (ms, screen name)
+        self.actions = [] # scripted (ms after boot, action)
+        self.boot_ms = None
+        self.loops = 0
+        self.max_loop_us = 0
+        self.max_gap_us = 0 # longest time between two UI passes
+        self.last_pass = None
+        self.hrv = None
+        self.ui = None
+        with self.firmware_context():
+            # fresh module state (oled, mqtt session, result log) every run
+            sys.modules.pop("hrv", None)
+            import uasyncio
+            uasyncio.new_event_loop()
+            import hrv
+            self.hrv = hrv
+            if wifi:
+                self.board.networks[hrv.SSID] = hrv.PASSWORD
+
+    @contextlib.contextmanager
+    def firmware_context(self):
+        cwd = os.getcwd()
+        os.makedirs(self.workdir, exist_ok=True)
+        os.chdir(self.workdir)
+        try:
+            if self.quiet:
+                with contextlib.redirect_stdout(self.output):
+                    yield
+            else:
+                yield
+        finally:
+            os.chdir(cwd)
+
+    def script(self, script, gap_ms=300, start_ms=0):
+        # Queues script actions, timed from boot. Returns the ms the script
+        # takes.
+        at = start_ms
+        for action, ms in parse_script(script):
+            if action == "wait":
+                at += ms
+                continue
+            at += gap_ms
+            if action == "hold":
+                self.actions.append((at, lambda pin=ms: self.board.set_pin(pin, 0)))
+            elif action == "release":
+                self.actions.append((at, lambda pin=ms: self.board.set_pin(pin, 1)))
+            else:
+                self.actions.append((at, getattr(self.encoder, action)))
+        return at
+
+    def every(self, ms, callback):
+        self.board.clock.schedule(ms * 1000, callback, ms * 1000)
+
+    def boot(self):
+        # main() up to the event loop
+        rot = self.hrv.Encoder(*ENCODER_PINS)
+        self.ui = self.hrv.UI(rot, SENSOR_PIN, 9, 7)
+        self.ui.display = self.timed(self.ui.display)
+        for at, action in self.actions:
+            self.board.clock.schedule(at * 1000, action)
+        self.actions = []
+
+    def timed(self, display):
+        # UI.display() that records the screen changes and its own duration
+        # and costs loop_us of virtual CPU time
+        clock = self.board.clock
+        ui = self.ui
+
+        def timed_display():
+            if self.boot_ms is None:
+                self.boot_ms = clock.elapsed_us() // 1000
+            name = ui.screen.__name__
+            if not self.screens or self.screens[-1][1] != name:
+                self.screens.append((clock.elapsed_us() // 1000, name))
+            start = clock.us
+            if self.last_pass is not None and start - self.last_pass > self.max_gap_us:
+                self.max_gap_us = start - self.last_pass
+            clock.spend(self.loop_us)
+            display()
+            spent = clock.us - start
+            if spent > self.max_loop_us:
+                self.max_loop_us = spent
+            self.loops += 1
+            self.last_pass = clock.us
+        return timed_display
+
+    def run(self, duration_ms):
+        # Boots the firmware and runs it until duration_ms of virtual time
+        # have passed. Returns the report. A simulation runs once.
+        clock = self.board.clock
+        clock.deadline = clock.us + duration_ms * 1000
+        host = time.perf_counter()
+        with self.firmware_context():
+            try:
+                self.boot()
+                self.hrv.asyncio.run(self.hrv.run(self.ui))
+            except sim.clock.SimulationEnd:
+                pass
+            return self.report(time.perf_counter() - host)
+
+    def report(self, host_s):
+        board = self.board
+        oled = self.hrv.oled
+        virtual_s = board.clock.elapsed_us() / 1e6
+        topics = {}
+        for us, topic, msg in board.broker.published:
+            topics[topic] = topics.get(topic, 0) + 1
+        return {
+            "virtual_s": virtual_s,
+            "host_s": host_s,
+            "speedup": virtual_s / host_s if host_s else 0,
+            "loops": self.loops,
+            "busy": 1 - board.stats["idle_us"] / 1e6 / virtual_s if virtual_s else 0,
+            "max_loop_ms": self.max_loop_us / 1000,
+            "max_gap_ms": self.max_gap_us / 1000,
+            "frames": oled.frames,
+            "frames_skipped": oled.skipped,
+            "oled_bytes": oled.bytes_sent,
+            "i2c_ms": board.stats["i2c_us"] / 1000,
+            "fifo_dropped": board.stats["fifo_dropped"],
+            "published": topics,
+            "results": self.hrv.results_log.count(),
+            "boot_ms": self.boot_ms,
+            "first_frame_ms": sim.ticks_diff(self.ui.first_frame, (board.clock.start_us // 1000) & sim.clock.TICKS_MAX) if self.ui and self.ui.first_frame is not None else None,
+            "screens": list(self.screens)
+        }
+
+def print_report(report):
+    print(f"virtual time {report['virtual_s']:.1f} s in {report['host_s']:.2f} s host time ({report['speedup']:.0f}x)")
+    if report["boot_ms"] is not None:
+        print(f"boot         {report['boot_ms']} ms to the UI loop, first frame after {report['first_frame_ms']} ms")
+    print(f"main loop    {report['loops']} passes, longest {report['max_loop_ms']:.1f} ms, busy {report['busy'] * 100:.0f}% of the time, "
+          f"longest gap {report['max_gap_ms']:.0f} ms")
+    print(f"display      {report['frames']} frames, {report['frames_skipped']} unchanged, "
+          f"{report['oled_bytes']} bytes, {report['i2c_ms']:.0f} ms on I2C")
+    print(f"sensor fifo  {report['fifo_dropped']} samples dropped")
+    print(f"mqtt         {report['published'] or 'nothing published'}")
+    print(f"results      {report['results']} in the result log")
+    print("screens:")
+    for ms, name in report["screens"]:
+        print(f"  {ms / 1000:8.3f} s  {name}")
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the HRV monitor firmware on a simulated Pico")
+    parser.add_argument("captures", nargs="*", default=["sample_data/capture_250Hz_01.txt"], help="captures replayed into the pulse sensor")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="encoder actions, e.g. 'right, press, wait:1000, press'")
+    parser.add_argument("--duration", type=int, help="virtual ms to run (default: boot, the script and 2 s)")
+    parser.add_argument("--loop-us", type=int, default=200, help="virtual CPU time of one UI pass")
+    parser.add_argument("--cpu-scale", type=float, help="also charge host CPU time times this factor")
+    parser.add_argument("--start-us", type=int, default=0, help="initial clock, e.g. close to 2**30 to test ticks wrap-around")
+    parser.add_argument("--no-wifi", action="store_true", help="the group WLAN is not in range")
+    parser.add_argument("--broker-offline", action="store_true", help="the MQTT broker does not answer")
+    parser.add_argument("--kubios-delay", type=int, default=1500, help="ms until the simulated Kubios reply")
+    parser.add_argument("--workdir", help="flash directory of the device (default: a new temporary one)")
+    parser.add_argument("--dump", help="directory for PNG frames of the display")
+    parser.add_argument("--dump-every", type=int, default=1000, help="ms between PNG frames")
+    parser.add_argument("--ascii", action="store_true", help="print the display at the end")
+    parser.add_argument("--verbose", action="store_true", help="show the firmware's prints")
+    args = parser.parse_args(argv)
+
+    simulation = Simulation(args.captures, args.workdir, args.start_us, args.cpu_scale, args.loop_us,
+                            not args.no_wifi, not args.broker_offline, args.kubios_delay, not args.verbose)
+    length = simulation.script(args.script)
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+        display = simulation.board.display
+        clock = simulation.board.clock
+        dump = os.path.abspath(args.dump)
+        simulation.every(args.dump_every, lambda: display.png(os.path.join(dump, f"{clock.elapsed_us() // 1000:08d}.png")))
+    report = simulation.run(args.duration or length + 2000)
+    print_report(report)
+    if args.ascii:
+        print(simulation.board.display.ascii())
+    return 0